@@ -7,105 +7,1232 @@ import pandas as pd		# to easily parse json object and filter out data; require
 import numpy as np              # to parse advanced numerical data structures; require installation
 import csv			# to read any column-like text file
 import re                       # to use regular expressions, e.g., to extract numerical part of a string for sorting
+import io                       # to parse byte ranges of the raw file
+import json                     # to save schema of binary data chunks
+import tempfile                 # to create temporary directory for spill files
+import shutil                   # to remove temporary directory with spill files
+from itertools import groupby, chain, islice   # to iterate over consecutive data pieces sharing the same label
+from functools import partial   # to pass the stride of windows to the resizing function
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED    # to resize chunks (decompress blocks) in parallel
+from collections import deque   # to queue blocks decompressed in advance
+import gzip                     # to read gzip compressed inputs
+import zlib                     # to decompress blocks of bgzip compressed inputs
+import struct                   # to parse headers of bgzip blocks
+import time                     # to measure the I/O wait hidden by prefetching
 
 
 LABELS = {}
 STATS = {}
+CHUNK_FORMATS = ['csv', 'npy', 'parquet']
+STAT_NAMES = ['ave', 'mean', 'sum', 'min', 'max', 'std', 'var', 'count', 'median']
+SKETCH_ALPHA = 0.01             # relative accuracy of quantiles estimated from the sketch
+SKETCH_CODES = 2**19            # number of sketch buckets reserved for each column of a slice
+RUN_END = 'run_end'             # column with the last position of the run of identical rows
+INPUT_FORMATS = ['rows', 'runs', 'bedgraph']
+OUTPUT_FORMATS = ['csv', 'parquet']
+CHECKPOINT_SECONDS = 10         # completed labels are synced to the disk and recorded in the checkpoint manifest at most this often
+CHECKPOINT_BYTES = 64*1024*1024 # or after this amount of output data
+
+
+def slice_sizes(value):
+    """Parse a single slice size or a comma-separated list of slice sizes for the multi-resolution pyramid"""
+
+    sizes = sorted(float(x) for x in str(value).split(','))
+    if len(sizes) == 1:
+        return sizes[0]
+    for size in sizes[1:]:
+        if abs(size / sizes[0] - round(size / sizes[0])) > 1e-9:
+            raise argparse.ArgumentTypeError('coarser slice sizes must be multiples of the finest one: '+str(value))
+    return list(dict.fromkeys(sizes))
+
+
+def calc_stats(value):
+    """Parse a single statistic or a comma-separated list of statistics computed over each slice"""
+
+    stats = list(dict.fromkeys(x.strip() for x in str(value).split(',') if x.strip()))
+    for stat in stats:
+        if stat not in STAT_NAMES and not re.fullmatch(r'q(100|\d{1,2})(\.\d+)?', stat):
+            raise argparse.ArgumentTypeError('unknown statistic: '+str(stat)+'; use any of: '+', '.join(STAT_NAMES)+' or qXX (XX-th percentile)')
+    if not stats:
+        raise argparse.ArgumentTypeError('no statistic provided')
+    return stats[0] if len(stats) == 1 else stats
+
+
+def shard_spec(value):
+    """Parse the shard of labels to be processed as i/N (the i-th of N shards, numbered from 0)"""
+
+    try:
+        i, n = (int(x) for x in str(value).split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('the shard has to be provided as i/N, e.g., 0/4: '+str(value))
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError('the shard number has to be from 0 to N-1: '+str(value))
+    return i, n
+
+
+def label_shard(label, n):
+    """Assign the label to one of n shards by a stable hash of its name (the same in all processes and runs)"""
+
+    return zlib.crc32(str(label).encode()) % n
+
+
+def shard_tag(shard):
+    """Get the suffix of output files for the shard"""
+
+    return '.shard'+str(shard[0])+'of'+str(shard[1]) if shard else ''
+
+
+def merge_shards(output):
+    """Merge outputs and statistics (label_in_chunks) of all shards into a single output in natural order of labels"""
+
+    base = re.sub(r'\.(csv|parquet)$', '', output)
+    groups = {}                                 # output suffix: {shard number: shard output}
+    total = None
+    for name in os.listdir(os.path.dirname(base) or '.'):
+        path = os.path.join(os.path.dirname(base), name)
+        found = re.fullmatch(re.escape(os.path.basename(base))+r'\.shard(\d+)of(\d+)(.*)', name)
+        if not found or found.group(3).endswith(('.part', '.ckpt')):
+            continue
+        if total is not None and int(found.group(2)) != total:
+            logging.error('The outputs of different sharding settings (N) were found for: '+str(base))
+            sys.exit(1)
+        total = int(found.group(2))
+        groups.setdefault(found.group(3), {})[int(found.group(1))] = path
+    if not groups:
+        logging.error('There are NO shard outputs to merge for: '+str(base))
+        sys.exit(1)
+    for suffix, files in groups.items():
+        missing = [i for i in range(total) if i not in files]
+        if missing:
+            logging.error('The outputs of shards '+str(missing)+' of '+str(total)+' are missing (or incomplete) for: '+str(base + suffix))
+            sys.exit(1)
+
+    for suffix, files in sorted(groups.items()):
+        outfile = base + suffix
+        logging.info('Merging '+str(total)+' shards into the '+str(outfile)+' output...')
+        if os.path.isdir(files[0]):             # directories of parquet files, one per label
+            parts = []
+            for i in range(total):
+                for name in os.listdir(files[i]):
+                    part = os.path.join(files[i], name)
+                    parts.append((str(pd.read_parquet(part).iloc[0, 0]), part))
+            remove_path(outfile + '.part')
+            os.makedirs(outfile + '.part')
+            for num, (lab, part) in enumerate(sorted(parts, key=lambda x: natural_sort(x[0]))):
+                shutil.copyfile(part, os.path.join(outfile + '.part', 'part_'+str(num)+'.parquet'))
+        else:                                   # csv files with contiguous blocks of rows of each label
+            blocks = []
+            header = None
+            for i in range(total):
+                with open(files[i], 'rb') as f:
+                    header = f.readline()
+                    start = f.tell()
+                    lab = None
+                    for line in iter(f.readline, b''):
+                        this_label = line.split(b',', 1)[0]
+                        if this_label != lab:
+                            if lab is not None:
+                                blocks.append((lab.decode(), files[i], start, f.tell() - len(line)))
+                            lab, start = this_label, f.tell() - len(line)
+                    if lab is not None:
+                        blocks.append((lab.decode(), files[i], start, f.tell()))
+            with open(outfile + '.part', 'wb') as out:
+                out.write(header or b'')
+                for lab, path, start, end in sorted(blocks, key=lambda x: natural_sort(x[0])):
+                    with open(path, 'rb') as f:
+                        f.seek(start)
+                        out.write(f.read(end - start))
+        remove_path(outfile)
+        os.replace(outfile + '.part', outfile)
+        logging.info('-- merged output saved into the '+str(outfile)+' file.')
+
+    stats = [line for i in range(total) if os.path.exists('label_in_chunks'+shard_tag((i, total))+'.txt')
+             for line in open('label_in_chunks'+shard_tag((i, total))+'.txt', 'r')]
+    if stats:
+        with open('label_in_chunks.txt', 'w') as f:
+            f.write(''.join(sorted(stats, key=lambda x: natural_sort(x.split(',', 1)[0]))))
+        logging.info('-- merged statistics of labels saved into the label_in_chunks.txt file.')
+
+
+class BgzfReader(io.RawIOBase):
+    """Read BGZF (bgzip) compressed file, decompressing its independent blocks in parallel threads"""
+
+    def __init__(self, filename, threads):
+        self.raw = open(filename, 'rb')
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.ahead = deque()                    # futures of blocks decompressed in advance
+        self.size = threads * 4
+        self.buffer = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def next_block(self):
+        head = self.raw.read(12)
+        if len(head) < 12:
+            self.eof = True
+            return None
+        extra = self.raw.read(struct.unpack('<H', head[10:12])[0])
+        i, bsize = 0, None
+        while i + 4 <= len(extra):              # find BSIZE in the BC subfield
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == b'BC':
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise IOError('The input is not a valid BGZF file.')
+        return self.raw.read(bsize + 1 - 12 - len(extra))
+
+    def readinto(self, b):
+        while not self.buffer:
+            while not self.eof and len(self.ahead) < self.size:
+                block = self.next_block()
+                if block is not None:
+                    self.ahead.append(self.pool.submit(zlib.decompress, block[:-8], -15))
+            if not self.ahead:
+                return 0
+            self.buffer = self.ahead.popleft().result()
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.raw.close()
+        super().close()
+
+
+def input_compression(filename):
+    """Detect compression of the input file from its magic bytes: gzip, bgzip, zstd, or '' for plain text"""
+
+    with open(filename, 'rb') as f:
+        magic = f.read(16)
+    if magic[:2] == b'\x1f\x8b':
+        return 'bgzip' if magic[3] & 4 and magic[12:14] == b'BC' else 'gzip'
+    if magic[:4] == b'\x28\xb5\x2f\xfd':
+        return 'zstd'
+    return ''
+
+
+def open_input(filename, threads=1):
+    """Open raw input file as a binary stream, decompressing gzip, bgzip (in parallel threads), or zstd on the fly"""
+
+    compression = input_compression(filename)
+    if compression == 'bgzip' and threads > 1:
+        return io.BufferedReader(BgzfReader(filename, threads), buffer_size=1024*1024)
+    elif compression in ('gzip', 'bgzip'):
+        return gzip.open(filename, 'rb')
+    elif compression == 'zstd':
+        try:
+            import zstandard            # optional dependency, required for zstd compressed inputs only
+        except ImportError:
+            logging.error('Reading zstd compressed input requires the zstandard package: pip install zstandard')
+            sys.exit(1)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True))
+    return open(filename, 'rb')
+
+
+def read_sample(filename, n=101, threads=1):
+    """Read the first n lines of the (decompressed) input file as a text sample"""
+
+    with open_input(filename, threads) as f:
+        return b''.join(islice(f, n)).decode()
+
+
+class OutputWriter:
+    """Append resized data of each label to the output as soon as it is ready, and rename the temporary output when complete;
+       completed labels are recorded in the checkpoint manifest <output>.ckpt (JSON lines) to resume or append later,
+       in batches synced to the disk every CHECKPOINT_SECONDS or CHECKPOINT_BYTES of output; the manifest of the complete run
+       is removed unless it is kept for the resume or append modes (keep)"""
+
+    def __init__(self, output, n_split, output_format='csv', keep=False):
+        output = re.sub(r'\.(csv|parquet)$', '', output)
+        ext = '.' + output_format
+        if isinstance(n_split, list):           # each resolution of the pyramid is saved into a separate file
+            self.outfiles = [output + '_n' + ('%g' % size) + ext for size in n_split]
+        else:
+            self.outfiles = [output + ext]
+        self.output_format = output_format
+        self.checkpoint = output + '.ckpt'
+        self.keep = keep
+        self.handles = [None] * len(self.outfiles)
+        self.parts = 0
+        self.manifest = None                    # checkpoint manifest opened for appending
+        self.pending = []                       # records of labels written since the last sync
+        self.unsynced = 0                       # bytes of output written since the last sync
+        self.synced = time.time()
+
+    def read_checkpoint(self):
+        """Load entries of the checkpoint manifest: the settings of the run, completed labels, and the completion record"""
+
+        entries = []
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint, 'r') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:              # the last line may be cut by a crash
+                        break
+        return entries
+
+    def begin(self, head):
+        """Start new temporary outputs and the checkpoint manifest with the settings of the run"""
+
+        for outfile in self.outfiles:
+            remove_path(outfile + '.part')
+        self.restore([head])
+
+    def restore(self, entries):
+        """Continue the temporary outputs after the last label recorded in the checkpoint entries, discarding any data written later"""
+
+        self.parts = len(entries) - 1
+        outputs = entries[-1].get('outputs', [0] * len(self.outfiles))
+        for num, outfile in enumerate(self.outfiles):
+            part = outfile + '.part'
+            if self.output_format == 'parquet':
+                os.makedirs(part, exist_ok=True)
+                for name in os.listdir(part):
+                    if int(re.sub(r'\D', '', name)) >= self.parts:
+                        os.remove(os.path.join(part, name))
+            else:
+                with open(part, 'a') as f:
+                    f.truncate(outputs[num])
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def write(self, this_label, bini, state=None):
+        """Append the resized data of a label (or the list for all resolutions) to the temporary outputs and record the label as completed"""
+
+        outputs = []
+        for num, df in enumerate(bini if isinstance(bini, list) else [bini]):
+            part = self.outfiles[num] + '.part'
+            if self.output_format == 'parquet':         # directory of parquet files, one per label
+                os.makedirs(part, exist_ok=True)
+                values = [col for col in df.columns[2:] if col != 'count']
+                df.astype({col: np.float64 for col in values}).to_parquet(os.path.join(part, 'part_'+str(self.parts)+'.parquet'), index=False)
+                outputs.append(self.parts + 1)
+            else:
+                if self.handles[num] is None:
+                    self.handles[num] = open(part, 'a', buffering=1024*1024)
+                start = self.handles[num].tell()
+                df.to_csv(self.handles[num], index=False, header=(self.parts == 0))
+                outputs.append(self.handles[num].tell())
+                self.unsynced += outputs[-1] - start
+        self.parts += 1
+        label = this_label.item() if hasattr(this_label, 'item') else this_label
+        self.pending.append(json.dumps(dict({'label': label, 'outputs': outputs}, **(state or {}))) + '\n')
+        if time.time() - self.synced >= CHECKPOINT_SECONDS or self.unsynced >= CHECKPOINT_BYTES:
+            self.sync()
+
+    def sync(self):
+        """Flush the temporary outputs to the disk, and only then record the labels written since the last sync in the checkpoint manifest"""
+
+        for handle in self.handles:
+            if handle is not None:
+                handle.flush()
+                os.fsync(handle.fileno())
+        if self.pending:
+            if self.manifest is None:
+                self.manifest = open(self.checkpoint, 'a')
+            self.manifest.write(''.join(self.pending))
+            self.manifest.flush()
+            os.fsync(self.manifest.fileno())
+        self.pending, self.unsynced, self.synced = [], 0, time.time()
+
+    def close(self, state=None):
+        """Rename the temporary outputs into the final ones and record the run as complete in the checkpoint manifest (or remove it)"""
+
+        self.sync()
+        for num, outfile in enumerate(self.outfiles):
+            if self.handles[num] is not None:
+                self.handles[num].close()
+            if self.parts:
+                remove_path(outfile)
+                os.replace(outfile + '.part', outfile)
+                logging.info("4. Resized data saved into the "+str(outfile)+" file.")
+            else:
+                remove_path(outfile + '.part')
+        if self.keep:
+            if self.manifest is None:
+                self.manifest = open(self.checkpoint, 'a')
+            self.manifest.write(json.dumps(dict({'complete': True}, **(state or {}))) + '\n')
+        if self.manifest is not None:
+            self.manifest.close()
+        if not self.keep:
+            remove_path(self.checkpoint)
+        return self.parts
+
+
+class RowOffsets:
+    """Track byte offsets of rows in the plain raw file by counting line ends"""
+
+    def __init__(self, filename, offset, rows=0):
+        self.file = open(filename, 'rb')
+        self.offset = offset
+        self.rows = rows
+
+    def advance(self, rows, block_size=16*1024*1024):
+        """Move to the byte offset just after the given number of data rows"""
+
+        self.file.seek(self.offset)
+        while self.rows < rows:
+            block = self.file.read(block_size)
+            if not block:
+                break
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            if self.rows + len(ends) >= rows:
+                self.offset += int(ends[rows - self.rows - 1]) + 1
+                self.rows = rows
+                break
+            self.rows += len(ends)
+            self.offset += len(block)
+        return self.offset
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def tail_crc(filename, offset, size=65536):
+    """Checksum of the data just before the byte offset of the raw file, to detect changes of the data before appending"""
+
+    with open(filename, 'rb') as f:
+        f.seek(max(offset - size, 0))
+        return zlib.crc32(f.read(min(size, offset)))
+
+
+def restart_point(writer, head, resume='false', append='false'):
+    """Prepare outputs of the run: start new ones, or continue them after the labels completed in the checkpoint manifest (resume),
+       or after the labels preceding the last one of the completed run (append); returns entries of the labels kept, or None if there is nothing to do"""
+
+    entries = writer.read_checkpoint() if 'true' in (resume, append) else []
+    if entries and entries[0].get('settings') != head['settings']:
+        logging.error('The checkpoint manifest '+str(writer.checkpoint)+' was saved with different settings; remove it or run without resume/append options.')
+        sys.exit(1)
+    complete = len(entries) > 1 and 'complete' in entries[-1]
+    if resume == 'true' and complete:
+        logging.warning('The run saved in '+str(writer.checkpoint)+' is already complete; there is nothing to resume.')
+        return None
+    elif resume == 'true' and entries:
+        if entries[0]['input'] != head['input']:
+            logging.error('The input has changed since the interrupted run, so it can NOT be resumed.')
+            sys.exit(1)
+        logging.info('--Resuming the run after '+str(len(entries) - 1)+' completed labels...')
+        writer.restore(entries)
+        return entries
+    elif append == 'true' and complete:
+        last = entries[-1]
+        if last.get('offset') is None:
+            logging.error('The append mode requires the previous run with the resume or append option on the plain raw file read sequentially (not compressed, -u false, no -ix with -ll).')
+            sys.exit(1)
+        if head['input'][0] == last['offset']:
+            logging.warning('There are NO rows added to the raw file since the previous run.')
+            return None
+        if head['input'][0] < last['offset'] or tail_crc(head['settings']['input'], last['offset']) != last['crc']:
+            logging.error('The raw file has changed before the end of the previous run; only the appended rows can be binned with the append mode.')
+            sys.exit(1)
+        logging.info('--Appending rows added after the offset '+str(last['offset'])+'; the last label of the previous run is resized again...')
+        keep = [head] + entries[1:-2]
+        for outfile in writer.outfiles:
+            remove_path(outfile + '.part')
+            if os.path.exists(outfile):
+                os.replace(outfile, outfile + '.part')
+        writer.restore(keep)
+        return keep
+    elif 'true' in (resume, append):
+        logging.warning('There is NO checkpoint to '+('resume' if resume == 'true' else 'append')+'; starting a new run.')
+    writer.begin(head)
+    return [head]
+
+
+def remove_path(path):
+    """Remove the file or directory if it exists"""
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
 
 
 def natural_sort(s, _re=re.compile(r'(\d+)')):
     return [int(t) if i & 1 else t.lower() for i, t in enumerate(_re.split(s))]
 
 
-def get_delimiter(filename: str) -> str:
+def get_delimiter(sample: str) -> str:
     try:
-        with open(filename, 'r') as csvfile:
-            delimiter = str(csv.Sniffer().sniff(csvfile.read()).delimiter)
+        delimiter = str(csv.Sniffer().sniff(sample).delimiter)
         return delimiter
     except:
         logging.error('Identifying data delimiter has failed!')
     
 
-def identify_header(filename, sep, n=10, th=0.9):
+def identify_header(sample, sep, n=10, th=0.9):
     try:
-        df1 = pd.read_csv(filename, sep=sep, header='infer', nrows=n)
-        df2 = pd.read_csv(filename, sep=sep, header=None, nrows=n)
+        df1 = pd.read_csv(io.StringIO(sample), sep=sep, header='infer', nrows=n)
+        df2 = pd.read_csv(io.StringIO(sample), sep=sep, header=None, nrows=n)
         sim = (df1.dtypes.values == df2.dtypes.values).mean()
         cols = len(df1.columns)
         return ['infer', list(df1.columns)] if sim < th else [None, cols]
     except:
         logging.error('Identifying data header has failed!')
 
-def save_chunks(df, this_label):
-    path = os.path.join(os.getcwd(),'CHUNKS')
+def save_chunks(df, this_label, mode='w', chunk_format='csv', path='CHUNKS'):
+    path = os.path.join(os.getcwd(), path)
     try:
         os.makedirs(path, exist_ok=True)
-        outfile = 'chunk_' + str(this_label) + '.csv'
-        df.to_csv(os.path.join(path,outfile), index=False, mode='w', header=not os.path.exists(outfile))
+        outfile = 'chunk_' + str(this_label) + '.' + chunk_format
+        if chunk_format == 'csv':
+            df.to_csv(os.path.join(path,outfile), index=False, mode=mode, header=(mode == 'w' or not os.path.exists(os.path.join(path,outfile))))
+        else:
+            save_chunk_part(df, this_label, os.path.join(path,outfile), mode, chunk_format)
         logging.info("-- the dataframe saved into the file: "+str(outfile))
     except:
         logging.error("-- the dataframe could NOT be saved into the file: "+str(outfile))
 
 
-def resize_data(label_df, names, labels, ranges, stat, n_split, split_type, decimal):
-    """Resize data (by mean or sum) for a given label using split of n-bins or n-long step or values range"""
+def save_chunk_part(df, this_label, path, mode, chunk_format):
+    """Save the dataframe as a next part of the binary chunk: directory of .npy columns with schema.json sidecar, or parquet files"""
+
+    if mode == 'w':
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    schema_file = os.path.join(path, 'schema.json')
+    if os.path.exists(schema_file):
+        with open(schema_file, 'r') as f:
+            schema = json.load(f)
+    else:
+        schema = {'label': this_label.item() if hasattr(this_label, 'item') else this_label,
+                  'columns': [str(col) for col in df.columns], 'constants': [], 'dtypes': {}, 'parts': []}
+        schema['constants'] = [str(col) for col in df.columns if (df[col] == this_label).all()]     # label column is not stored
+    part = len(schema['parts'])
+    df = dense_columns(df)
+    if chunk_format == 'parquet':
+        df.to_parquet(os.path.join(path, 'part_'+str(part)+'.parquet'), index=False)
+    else:
+        for num, col in enumerate(df.columns):
+            if str(col) in schema['constants']:
+                continue
+            arr = df[col].to_numpy()
+            if arr.dtype == object:
+                arr = arr.astype(str)
+            np.save(os.path.join(path, 'part_'+str(part)+'_'+str(num)+'.npy'), arr)
+            schema['dtypes'][str(col)] = arr.dtype.str
+    schema['parts'].append(len(df))
+    with open(schema_file, 'w') as f:
+        json.dump(schema, f)
+
+
+def chunk_parts(filename):
+    """Yield parts of the saved chunk as dataframes; binary columns are loaded memory-mapped"""
+
+    if os.path.isfile(filename):
+        yield pd.read_csv(filename)
+        return
+    with open(os.path.join(filename, 'schema.json'), 'r') as f:
+        schema = json.load(f)
+    for part, rows in enumerate(schema['parts']):
+        if filename.endswith('.parquet'):
+            yield pd.read_parquet(os.path.join(filename, 'part_'+str(part)+'.parquet'), memory_map=True)
+            continue
+        data = {}
+        for num, col in enumerate(schema['columns']):
+            if col in schema['constants']:
+                data[col] = pd.Categorical.from_codes(np.zeros(rows, dtype=np.int8), [schema['label']])
+            else:
+                data[col] = np.load(os.path.join(filename, 'part_'+str(part)+'_'+str(num)+'.npy'), mmap_mode='r')
+        yield pd.DataFrame(data, copy=False)
+
+
+def chunk_label(filename):
+    """Extract label from the name of the saved chunk, e.g., chunk_<label>.csv"""
+
+    label = filename[len('chunk_'):]
+    for ext in CHUNK_FORMATS:
+        if label.endswith('.'+ext):
+            return label[:-len(ext)-1]
+    return label
+
+
+def resize_data(label_df, names, labels, ranges, stat, n_split, split_type, decimal, bounds=None, stride=0):
+    """Resize data (by statistics of columns) for a given label using split of n-bins or n-long step or values range or n-long windows sliding by stride rows;
+       value increments of the region bounds (start, end) start at the region start and are clipped at its end"""
 
     lr = [names[labels], names[ranges]]		# labels and ranges
     nd = [i for i in names if not i in lr] 	# numerical data
 
+    levels = n_split if isinstance(n_split, list) else [n_split]
+    need = stat_needs(stat)
+    if not len(label_df):
+        return None
+    lab = label_df[lr[0]].iloc[0]
+    pos = label_df[lr[1]].to_numpy()
+    sparse = not need and any(isinstance(label_df[col].dtype, pd.SparseDtype) for col in nd)     # sums of nonzero entries only
+
     if split_type == 'value':
         logging.info("-- slice data with constant increment of values in ranges column...")
-        lab = label_df[lr[0]].iloc[0]
-        mini = label_df[lr[1]].min()
-        maxi = label_df[lr[1]].max()
-        groups = label_df.groupby(pd.cut(label_df[lr[1]], np.arange(mini, maxi+n_split, n_split)))
-        counts = groups[lr[0]].count().reset_index(drop=True)
-        if stat == 'ave':
-            logging.info("-- aggregate data by averaging columns over the slice...")
-            bini = groups.mean().drop(lr[1], axis=1).reset_index()
+        edges = np.arange(pos.min() if bounds is None else bounds[0], pos.max()+levels[0], levels[0])
+        logging.info("-- aggregate "+str(stat)+" of columns over the slice...")
+        if sparse:
+            m = max(len(edges) - 1, 0)
+            ids = np.searchsorted(edges, pos, side='left') - 1
+            ids = np.where((ids >= 0) & (ids < m), ids, m)             # rows out of slices fall into the extra slice m
+            counts = np.bincount(ids, minlength=m+1)[:m]
+            sums, n = slice_sums(ids, m, label_df, nd, counts)
+            slices = (edges[:m], edges[1:m+1], sums, counts, {'n': n})
         else:
-            logging.info("-- aggregate data by summing columns over the slice...")
-            bini = groups.sum().drop(lr[1], axis=1).reset_index()            
-        bini['count'] = counts
-        bini.insert(0, lr[0], lab)
-        bini[nd] = bini[nd].round(decimal)
-        bini[lr[1]] = bini[lr[1]].astype(str).str.replace(', ', '-', regex=False).str.replace('(','', regex=False).str.replace(']','', regex=False)
-        return bini
+            slices = value_slices(pos, label_df[nd].to_numpy(dtype=np.float64), edges, need)
+
+    elif split_type == 'window':
+        window = int(levels[0])
+        stride = int(stride) or window
+        logging.info("-- slice data with overlapping windows of "+str(window)+" rows sliding by "+str(stride)+" rows...")
+        logging.info("-- aggregate "+str(stat)+" of columns over the window...")
+        slices = window_slices(pos, label_df[nd].to_numpy(dtype=np.float64), window, stride, need)
 
     else:
-        step = int(n_split)
+        step = int(levels[0])
         if split_type == 'bin':
             step = int(np.ceil(len(label_df)/n_split))
             logging.info("-- slice data with constant number of "+str(step)+" slices...")
         else:
             logging.info("-- slice data with constant number of "+str(step)+" rows in a slice...")
         try:
-            logging.info("-- concatenate ranges...")
-            maxi = label_df[lr[1]].max()
-            label_df['shift'] = label_df[lr[1]].shift(-step+1).fillna(maxi)
-            label_df['shift'] = label_df[lr[1]].astype(str) + '-' + label_df['shift'].astype(type(maxi)).astype(str)
-            indi = label_df[[lr[0], 'shift']].iloc[::step, :] 
-            indi.rename({'shift': lr[1]}, axis=1, inplace=True)
-            if stat == 'ave':
-                logging.info("-- aggregate data by averaging columns over the slice...")
-                bini = label_df.loc[:,nd].groupby(label_df.index // step).mean()
+            logging.info("-- aggregate "+str(stat)+" of columns over the slice...")
+            starts = np.arange(0, len(pos), step)                       # first row of each slice
+            counts = np.diff(np.append(starts, len(pos)))
+            lasts = np.where(starts + step - 1 < len(pos), pos[np.minimum(starts + step - 1, len(pos) - 1)], pos.max())
+            if sparse:
+                sums, n = slice_sums(np.repeat(np.arange(len(starts)), counts), len(starts), label_df, nd, counts)
+                slices = (pos[starts], lasts, sums, counts, {'n': n})
             else:
-                logging.info("-- aggregate data by summing columns over the slice...")
-                bini = label_df.loc[:,nd].groupby(label_df.index // step).sum()
+                vals, ok = nan_free(label_df[nd].to_numpy(dtype=np.float64))
+                sums = np.add.reduceat(vals, starts, axis=0)
+                n = np.add.reduceat(ok.astype(np.int64), starts, axis=0)
+                ids = np.repeat(np.arange(len(starts)), counts) if need else None
+                slices = (pos[starts], lasts, sums, counts, slice_extras(ids, len(starts), vals, sums, n, need, ok=ok))
         except:
-            logging.error("ERROR: Aggregating data has failed!")
+            logging.error('ERROR: Aggregating data has failed!')
+            sys.exit(1)
 
-        if len(indi) > 0 and len(bini) > 0:
-            try:
-                final = pd.concat((indi.reset_index(drop=True), bini.reset_index(drop=True)), axis=1)
-                final[nd] = final[nd].round(decimal)
-                return final
-            except:
-                logging.error('ERROR: Aggregating data has failed!')
+    logging.info("-- concatenate ranges...")
+    return finalize_slices(lab, lr, nd, slices, stat, n_split, split_type, decimal, label_df[nd].dtypes, None if bounds is None else bounds[1])
+
+
+def resize_runs(label_df, names, labels, ranges, stat, n_split, split_type, decimal, bounds=None):
+    """Resize data for a given label stored as runs of identical rows, weighting values of each run by the number of its rows in the slice"""
+
+    lr = [names[labels], names[ranges]]		# labels and ranges
+    nd = [i for i in label_df.columns if not i in lr + [RUN_END]]     # numerical data
+
+    levels = n_split if isinstance(n_split, list) else [n_split]
+    need = stat_needs(stat)
+    if not len(label_df):
+        return None
+    lab = label_df[lr[0]].iloc[0]
+    starts = label_df[lr[1]].to_numpy().astype(np.promote_types(label_df[lr[1]].dtype, np.int64))     # avoid overflow of downcast positions
+    lens = np.rint(label_df[RUN_END].to_numpy() - starts + 1).astype(np.int64)
+    vals, ok = nan_free(label_df[nd].to_numpy(dtype=np.float64))
+
+    if split_type == 'window':
+        logging.error('ERROR: The sliding windows are available for rows of data only (not runs).')
+        sys.exit(1)
+    if split_type == 'value':
+        logging.info("-- slice runs with constant increment of values in ranges column...")
+        edges = np.arange(starts.min() if bounds is None else bounds[0], label_df[RUN_END].max()+levels[0], levels[0])
+        m = max(len(edges) - 1, 0)
+        first = np.maximum(np.searchsorted(edges, starts, side='left') - 1, 0)
+        last = np.minimum(np.searchsorted(edges, starts + lens - 1, side='left') - 1, m - 1)
+        run, ids = run_segments(first, last)
+        lo = np.maximum(np.floor(edges[ids] - starts[run]) + 1, 0)              # rows of the run in the right-closed interval
+        hi = np.minimum(np.floor(edges[ids + 1] - starts[run]), lens[run] - 1)
+        weights = np.maximum(hi - lo + 1, 0).astype(np.int64)
+        firsts, lasts = edges[:m], edges[1:m+1]
+    else:
+        step = int(levels[0])
+        if split_type == 'bin':
+            step = int(np.ceil(lens.sum()/n_split))
+        logging.info("-- slice runs with constant number of "+str(step)+" rows in a slice...")
+        rows = np.cumsum(lens) - lens                                           # first row of each run
+        run, ids = run_segments(rows // step, (rows + lens - 1) // step)
+        lo = np.maximum(rows[run], ids * step)
+        hi = np.minimum(rows[run] + lens[run], (ids + 1) * step)
+        weights = hi - lo
+        m = ids[-1] + 1
+        head = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])                 # first and last segment of each slice
+        tail = np.r_[head[1:], len(ids)] - 1
+        firsts = starts[run[head]] + lo[head] - rows[run[head]]
+        lasts = starts[run[tail]] + hi[tail] - 1 - rows[run[tail]]
+
+    keep = weights > 0
+    run, ids, weights = run[keep], ids[keep], weights[keep]
+    logging.info("-- aggregate "+str(stat)+" of columns over the slice weighted by the length of runs...")
+    sums = np.column_stack([np.bincount(ids, weights=vals[run, c] * weights, minlength=m) for c in range(len(nd))]).reshape(m, len(nd))
+    counts = np.rint(np.bincount(ids, weights=weights, minlength=m)).astype(np.int64)
+    n = slice_counts(ids, m, ok[run], weights)
+    slices = (firsts, lasts, sums, counts, slice_extras(ids, m, vals[run], sums, n, need, weights, ok[run]))
+    return finalize_slices(lab, lr, nd, slices, stat, n_split, split_type, decimal, label_df[nd].dtypes, None if bounds is None else bounds[1])
+
+
+def run_segments(first, last):
+    """Split each run into segments of consecutive slices from first to last, returning the run and the slice of each segment"""
+
+    n = np.maximum(last - first + 1, 0)
+    run = np.repeat(np.arange(len(first)), n)
+    return run, first[run] + np.arange(len(run)) - np.repeat(np.cumsum(n) - n, n)
+
+
+def collapse_runs(df, names, labels, ranges):
+    """Collapse consecutive rows (or runs) with identical values and positions increasing by one into runs (label, start, values, end)"""
+
+    lr = [names[labels], names[ranges]]
+    if RUN_END not in df.columns:
+        df = df.assign(**{RUN_END: df[lr[1]]})
+    if len(df) < 2:
+        return df.reset_index(drop=True)
+    pos = df[lr[1]].to_numpy()
+    end = df[RUN_END].to_numpy()
+    same = pos[1:] - end[:-1] == 1
+    for col in df.columns:
+        if col not in lr + [RUN_END]:
+            val = df[col].to_numpy()
+            same &= val[1:] == val[:-1]
+    starts = np.flatnonzero(np.r_[True, ~same])
+    runs = df.iloc[starts].reset_index(drop=True)
+    runs[RUN_END] = end[np.r_[starts[1:], len(df)] - 1]
+    return runs
+
+
+def bedgraph_runs(df, names, ranges):
+    """Convert bedGraph intervals (label, 0-based start, end, values) into runs of 1-based positions (as in per-base depth files)"""
+
+    df = df.rename(columns={names[ranges+1]: RUN_END})
+    df[names[ranges]] = df[names[ranges]].astype(np.promote_types(df[names[ranges]].dtype, np.int64)) + 1
+    return df[[col for col in df.columns if col != RUN_END] + [RUN_END]]
+
+
+def run_pieces(source, names, labels, ranges, input_format):
+    """Collapse consecutive pieces of rows (or bedGraph intervals) of labels into runs on the fly"""
+
+    for lab, piece in source:
+        if input_format == 'bedgraph':
+            piece = bedgraph_runs(piece, names, ranges)
+        yield lab, collapse_runs(piece, names, labels, ranges)
+
+
+def window_slices(pos, vals, window, stride, need):
+    """Aggregate rows into windows of rows starting every stride rows (the last ones may be shorter) in O(n) per column, using differences of cumulative sums"""
+
+    n = len(pos)
+    starts = np.arange(0, max(n - window, 0) + stride, stride)
+    starts = starts[starts < n]
+    ends = np.minimum(starts + window, n)
+    counts = ends - starts
+
+    def window_sums(x):
+        csum = np.vstack([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+        return csum[ends] - csum[starts]
+
+    vals, ok = nan_free(vals)                   # NaN would spoil cumulative sums of all the following windows
+    sums = window_sums(vals)
+    n = np.rint(window_sums(ok.astype(np.float64))).astype(np.int64)
+    extra = {'n': n}
+    if 'm2' in need:                            # sums of squares of deviations from the column means limit the cancellation
+        dev = np.where(ok, vals - vals.sum(axis=0) / np.maximum(ok.sum(axis=0), 1), 0)
+        s1, s2 = window_sums(dev), window_sums(dev ** 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            extra['m2'] = np.where(n > 0, np.maximum(s2 - s1 ** 2 / n, 0), 0)
+    if 'minmax' in need:
+        full = np.flatnonzero(counts == window)
+        for key, func, empty in (('min', np.min, np.inf), ('max', np.max, -np.inf)):
+            filled = np.where(ok, vals, empty)              # missing values are skipped
+            extra[key] = np.empty(sums.shape)
+            if len(full):
+                extra[key][full] = func(np.lib.stride_tricks.sliding_window_view(filled, window, axis=0)[starts[full]], axis=-1)
+            for i in np.flatnonzero(counts < window):           # shorter windows at the end
+                extra[key][i] = func(filled[starts[i]:ends[i]], axis=0)
+    return pos[starts], pos[ends - 1], sums, counts, extra
+
+
+def load_regions(filename):
+    """Load regions from the BED file (label, 0-based start, end) and index them per label as sorted arrays of starts and ends of merged intervals"""
+
+    bed = pd.read_csv(filename, sep='\t', header=None, usecols=[0, 1, 2], names=['label', 'start', 'end'], dtype={'label': str}, comment='#')
+    bed[['start', 'end']] = bed[['start', 'end']].apply(pd.to_numeric, errors='coerce')
+    bed = bed.dropna().sort_values(by=['label', 'start'], kind='stable')     # skip track and browser lines
+    regions = {}
+    for lab, group in bed.groupby('label', sort=False):
+        starts = group['start'].to_numpy(np.int64)
+        ends = group['end'].to_numpy(np.int64)
+        heads = np.flatnonzero(np.r_[True, starts[1:] > np.maximum.accumulate(ends)[:-1]])    # overlapping or adjacent regions are merged
+        regions[lab] = (starts[heads], np.maximum.reduceat(ends, heads))
+    logging.info('--Loaded '+str(sum(len(b[0]) for b in regions.values()))+' regions for '+str(len(regions))+' labels.')
+    return regions
+
+
+def region_spans(first, last, bounds):
+    """Find the first and the last region overlapping each row (or run) from first to last position (last < first for no region);
+       a position p is in the region (start, end) when start < p <= end, i.e., 1-based positions in 0-based BED intervals"""
+
+    starts, ends = bounds
+    return np.searchsorted(ends, first, side='left'), np.searchsorted(starts, last, side='left') - 1
+
+
+def region_rows(df, names, ranges, bounds):
+    """Drop rows outside the regions of the label with a vectorized mask, splitting runs at the boundaries of regions"""
+
+    pos = df[names[ranges]].to_numpy()
+    if RUN_END not in df.columns:
+        first, last = region_spans(pos, pos, bounds)
+        return df[first <= last]
+    end = df[RUN_END].to_numpy()
+    run, region = run_segments(*region_spans(pos, end, bounds))
+    df = df.iloc[run].reset_index(drop=True)
+    df[names[ranges]] = np.maximum(pos[run].astype(np.promote_types(pos.dtype, np.int64)), bounds[0][region] + 1)
+    df[RUN_END] = np.minimum(end[run], bounds[1][region])
+    return df
+
+
+def region_pieces(source, names, ranges, regions):
+    """Drop rows outside the regions from each piece of a label before the pieces are merged; labels without regions are skipped"""
+
+    for lab, piece in source:
+        bounds = regions.get(str(lab))
+        if bounds is not None:
+            piece = region_rows(piece, names, ranges, bounds)
+            if len(piece):
+                yield lab, piece
+
+
+def concat_resized(parts, n_split):
+    """Concatenate resized data of consecutive regions (dataframes, or lists of dataframes for all resolutions)"""
+
+    parts = [bini if isinstance(bini, list) else [bini] for bini in parts if bini is not None]
+    if not parts:
+        return None
+    out = [pd.concat([bini[num] for bini in parts], ignore_index=True) for num in range(len(parts[0]))]
+    return out if isinstance(n_split, list) else out[0]
+
+
+def resize_regions(label_df, names, labels, ranges, stat, n_split, split_type, decimal, bounds, resize=resize_data):
+    """Resize data of a label (sorted by ranges) separately within each of its regions, so slices are clipped to the region boundaries"""
+
+    region = np.searchsorted(bounds[1], label_df[names[ranges]].to_numpy(), side='left')
+    cuts = np.flatnonzero(np.diff(region)) + 1
+    parts = []
+    for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(region)]):
+        i = region[a]
+        parts.append(resize(label_df.iloc[a:b], names, labels, ranges, stat, n_split, split_type, decimal, (bounds[0][i], bounds[1][i])))
+    return concat_resized(parts, n_split)
+
+
+def stream_regions(pieces, names, labels, ranges, stat, n_split, split_type, decimal, bounds):
+    """Resize streamed data of a label separately within each of its regions, splitting pieces at the region boundaries"""
+
+    def split(pieces):
+        last = -1
+        for piece in pieces:
+            region = np.searchsorted(bounds[1], piece[names[ranges]].to_numpy(), side='left')
+            if not len(region):
+                continue
+            if region[0] < last or (np.diff(region) < 0).any():
+                logging.error('ERROR: The streaming engine requires data sorted ascending by ranges column within each label.')
                 sys.exit(1)
+            last = region[-1]
+            cuts = np.flatnonzero(np.diff(region)) + 1
+            for a, b in zip(np.r_[0, cuts], np.r_[cuts, len(region)]):
+                yield region[a], piece.iloc[a:b]
+
+    parts, rows, mem = [], 0, 0
+    for i, group in groupby(split(pieces), key=lambda x: x[0]):
+        bini, n, m = stream_resize((piece for r, piece in group), names, labels, ranges, stat, n_split, split_type, decimal, (bounds[0][i], bounds[1][i]))
+        parts.append(bini)
+        rows += n
+        mem += m
+    return concat_resized(parts, n_split), rows, mem
+
+
+def nan_free(vals):
+    """Zero missing values, so sums skip them (as pandas does), and return the mask of non-missing values"""
+
+    ok = ~np.isnan(vals)
+    return (vals if ok.all() else np.where(ok, vals, 0)), ok
+
+
+def slice_counts(ids, m, ok, weights=None):
+    """Count non-missing values of each column in m slices (rows weighted optionally)"""
+
+    w = ok if weights is None else ok * weights[:, None]
+    return np.rint(np.column_stack([np.bincount(ids, weights=w[:, c], minlength=m) for c in range(ok.shape[1])]).reshape(m, ok.shape[1])).astype(np.int64)
+
+
+def slice_sums(ids, m, label_df, nd, counts):
+    """Sum columns over m slices (slice ids of rows; m for rows out of slices), adding only nonzero entries of sparse columns;
+       returns the sums and the counts of non-missing values (counts of rows less missing ones)"""
+
+    sums = np.zeros((m, len(nd)))
+    n = np.repeat(np.asarray(counts, dtype=np.int64)[:, None], len(nd), axis=1)
+    for c, col in enumerate(nd):
+        if isinstance(label_df[col].dtype, pd.SparseDtype):
+            array = label_df[col].array
+            ids_c, vals = ids[array.sp_index.indices], array.sp_values.astype(np.float64)
+        else:
+            ids_c, vals = ids, label_df[col].to_numpy(dtype=np.float64)
+        nans = np.isnan(vals)
+        sums[:, c] = np.bincount(ids_c, weights=np.where(nans, 0, vals), minlength=m+1)[:m]
+        n[:, c] -= np.bincount(ids_c, weights=nans, minlength=m+1)[:m].astype(np.int64)
+    return sums, n
+
+
+def value_slices(pos, vals, edges, need):
+    """Aggregate rows into the right-closed slices between consecutive edges of value increments (as pd.cut does)"""
+
+    ids = np.searchsorted(edges, pos, side='left') - 1
+    keep = (ids >= 0) & (ids < len(edges) - 1)
+    ids, (vals, ok) = ids[keep], nan_free(vals[keep])
+    m = max(len(edges) - 1, 0)
+    sums = np.column_stack([np.bincount(ids, weights=vals[:, c], minlength=m) for c in range(vals.shape[1])]).reshape(m, vals.shape[1])
+    counts = np.bincount(ids, minlength=m)
+    return edges[:m], edges[1:m+1], sums, counts, slice_extras(ids, m, vals, sums, slice_counts(ids, m, ok), need, ok=ok)
+
+
+def pad_slices(slices, edges, nd, need):
+    """Extend slices of the shared grid (or no slices) with empty ones up to the last of the edges"""
+
+    m = len(edges) - 1
+    if slices is None:
+        slices = (edges[:0], edges[:0], np.zeros((0, nd)), np.zeros(0, dtype=np.int64), slice_extras(np.zeros(0, dtype=np.int64), 0, np.zeros((0, nd)), None, np.zeros((0, nd), dtype=np.int64), need))
+    firsts, lasts, sums, counts, extra = slices
+    k = m - len(counts)
+    extra = dict(extra)
+    for key, empty in (('n', 0), ('min', np.inf), ('max', -np.inf), ('m2', 0)):
+        if key in extra:
+            extra[key] = np.vstack([extra[key], np.full((k, nd), empty, dtype=extra[key].dtype)])
+    return edges[:m], edges[1:], np.vstack([sums, np.zeros((k, nd))]), np.append(counts, np.zeros(k, dtype=np.int64)), extra
+
+
+def add_slices(a, b):
+    """Merge aggregates of two sets of the same slices (e.g., fragments of a label on the shared grid)"""
+
+    firsts, lasts, sa, ca, ea = a
+    sb, cb, eb = b[2], b[3], b[4]
+    na, nb = ea['n'], eb['n']
+    extra = {'n': na + nb}
+    for key, func in (('min', np.minimum), ('max', np.maximum)):
+        if key in ea:
+            extra[key] = func(ea[key], eb[key])
+    if 'm2' in ea:                                              # pairwise form of Welford's update (Chan et al.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = sb / nb - sa / na
+            extra['m2'] = ea['m2'] + eb['m2'] + np.where(na * nb > 0, delta ** 2 * (na * nb / (na + nb)), 0)
+    if 'sketch' in ea:
+        keys, inv = np.unique(np.concatenate([ea['sketch'][0], eb['sketch'][0]]), return_inverse=True)
+        extra['sketch'] = (keys, np.bincount(inv, weights=np.concatenate([ea['sketch'][1], eb['sketch'][1]]), minlength=len(keys)).astype(np.int64))
+    return firsts, lasts, sa + sb, ca + cb, extra
+
+
+def stat_needs(stat):
+    """Get the aggregates of slices (beyond sums and counts of rows) required to compute the statistics"""
+
+    need = set()
+    for s in (stat if isinstance(stat, list) else [stat]):
+        if s in ('min', 'max'):
+            need.add('minmax')
+        elif s in ('std', 'var'):
+            need.add('m2')
+        elif s == 'median' or s.startswith('q'):        # sketch estimates are clipped to the range of values
+            need.update(['minmax', 'sketch'])
+    return need
+
+
+def slice_extras(ids, m, vals, sums, n, need, weights=None, ok=None):
+    """Aggregate counts of non-missing values (n), minimum, maximum, sum of squared deviations from the mean, and quantile sketch of values
+       in m slices (rows weighted optionally); missing values (ok mask is False) are skipped"""
+
+    extra = {'n': n}
+    if not need:
+        return extra
+    if ok is None:
+        ok = np.ones(vals.shape, dtype=bool)
+    if len(ids) > 1 and (np.diff(ids) < 0).any():              # group rows of the same slice together
+        order = np.argsort(ids, kind='stable')
+        ids, vals, ok = ids[order], vals[order], ok[order]
+        weights = weights[order] if weights is not None else None
+    if 'minmax' in need:
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else []
+        for key, func, empty in (('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)):
+            extra[key] = np.full((m, vals.shape[1]), empty)
+            if len(ids):
+                extra[key][ids[starts]] = func.reduceat(np.where(ok, vals, empty), starts, axis=0)
+    if 'm2' in need:                                            # deviations from the mean of the slice (two-pass)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dev = np.where(ok, vals - (sums / n)[ids], 0) ** 2
+        if weights is not None:
+            dev = dev * weights[:, None]
+        extra['m2'] = np.column_stack([np.bincount(ids, weights=dev[:, c], minlength=m) for c in range(vals.shape[1])]).reshape(m, vals.shape[1])
+    if 'sketch' in need:
+        codes = np.where(ok, sketch_codes(vals), -1)
+        keys = ((ids[:, None] * vals.shape[1] + np.arange(vals.shape[1])) * SKETCH_CODES + codes)[codes >= 0]
+        if weights is None:
+            extra['sketch'] = np.unique(keys, return_counts=True)
+        else:
+            keys, inv = np.unique(keys, return_inverse=True)
+            cnts = np.broadcast_to(weights[:, None], codes.shape)[codes >= 0]
+            extra['sketch'] = (keys, np.rint(np.bincount(inv, weights=cnts, minlength=len(keys))).astype(np.int64))
+    return extra
+
+
+def sketch_codes(vals):
+    """Map values to the buckets of the mergeable quantile sketch with constant relative accuracy (non-finite values get -1)"""
+
+    gamma = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.ceil(np.log(np.maximum(np.abs(vals), 1e-300)) / np.log(gamma)) + SKETCH_CODES // 4
+    codes = np.where(vals > 0, k, np.where(vals < 0, -k, 0)) + SKETCH_CODES // 2      # buckets ordered as values
+    return np.where(np.isfinite(vals), codes, -1).astype(np.int64)
+
+
+def sketch_values(codes):
+    """Get representative values of the sketch buckets"""
+
+    gamma = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+    c = codes - SKETCH_CODES // 2
+    return np.where(c == 0, 0.0, np.sign(c) * 2 * gamma ** (np.abs(c) - SKETCH_CODES // 4) / (gamma + 1))
+
+
+def sketch_quantiles(sketch, m, nd, q):
+    """Estimate q-quantile of each column in each slice from the sketch, as the value of the bucket holding the q-th rank"""
+
+    keys, cnts = sketch
+    out = np.full((m, nd), np.nan)
+    if not len(keys):
+        return out
+    group = keys // SKETCH_CODES                                # slice * nd + column
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    total = np.cumsum(cnts)
+    base = np.r_[0, total[starts[1:] - 1]]
+    idx = np.searchsorted(total, base + q * (np.add.reduceat(cnts, starts) - 1), side='right')
+    out.flat[group[starts]] = sketch_values(keys[idx] % SKETCH_CODES)
+    return out
+
+
+def combine_slices(slices, groups):
+    """Combine consecutive slices of the same group (numbered from 0) into a single slice, merging all their aggregates"""
+
+    firsts, lasts, sums, counts, extra = slices
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ends = np.r_[starts[1:], len(groups)] - 1
+    total = np.add.reduceat(sums, starts, axis=0)
+    rows = np.add.reduceat(counts, starts)
+    n = np.add.reduceat(extra['n'], starts, axis=0)
+    merged = {'n': n}
+    for key, func in (('min', np.minimum), ('max', np.maximum)):
+        if key in extra:
+            merged[key] = func.reduceat(extra[key], starts, axis=0)
+    if 'm2' in extra:                                           # parallel form of Welford's update (Chan et al.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dev = sums / extra['n'] - (total / n)[groups]
+            merged['m2'] = np.add.reduceat(extra['m2'] + np.where(extra['n'] > 0, extra['n'] * dev ** 2, 0), starts, axis=0)
+    if 'sketch' in extra:                                       # buckets are merged by adding their counts
+        keys, cnts = extra['sketch']
+        stride = sums.shape[1] * SKETCH_CODES
+        keys, inv = np.unique(groups[keys // stride] * stride + keys % stride, return_inverse=True)
+        merged['sketch'] = (keys, np.bincount(inv, weights=cnts, minlength=len(keys)).astype(np.int64))
+    return firsts[starts], lasts[ends], total, rows, merged
+
+
+def concat_slices(parts):
+    """Concatenate consecutive parts of slices, renumbering the slices in their sketches"""
+
+    extra = {}
+    for key in parts[0][4]:
+        if key == 'sketch':
+            offsets = np.cumsum([0] + [len(p[3]) for p in parts[:-1]]) * parts[0][2].shape[1] * SKETCH_CODES
+            extra[key] = (np.concatenate([p[4][key][0] + o for p, o in zip(parts, offsets)]), np.concatenate([p[4][key][1] for p in parts]))
+        else:
+            extra[key] = np.concatenate([p[4][key] for p in parts])
+    return tuple(np.concatenate([p[i] for p in parts]) for i in range(4)) + (extra,)
+
+
+def range_slices(slices, a, b):
+    """Take the slices numbered from a to b (exclusive)"""
+
+    firsts, lasts, sums, counts, extra = slices
+    part = {}
+    for key, val in extra.items():
+        if key == 'sketch':
+            stride = sums.shape[1] * SKETCH_CODES
+            keep = (val[0] >= a * stride) & (val[0] < b * stride)
+            part[key] = (val[0][keep] - a * stride, val[1][keep])
+        else:
+            part[key] = val[a:b]
+    return firsts[a:b], lasts[a:b], sums[a:b], counts[a:b], part
+
+
+def coarsen_slices(slices, k, size, split_type):
+    """Combine each k consecutive slices into a single coarser slice (size) using their aggregates"""
 
+    m = len(slices[3])
+    if not m:
+        return slices
+    firsts, lasts, sums, counts, extra = combine_slices(slices, np.arange(m) // k)
+    if split_type == 'value':                   # edges of coarser value increments start at the same minimum
+        edges = np.arange(slices[0][0], slices[0][0] + (len(counts) + 0.5) * size, size)[:len(counts) + 1]
+        return edges[:-1], edges[1:], sums, counts, extra
+    return firsts, lasts, sums, counts, extra
 
-def concat_label_chunks(this_label, all_data, ranges, chunk_save):
+
+def finalize_slices(lab, lr, nd, slices, stat, n_split, split_type, decimal, dtypes, clip=None):
+    """Build the dataframe of slices, or the list of dataframes for all resolutions when n_split is a list of slice sizes;
+       value increments are clipped at the end of the region (clip)"""
+
+    levels = n_split if isinstance(n_split, list) else [n_split]
+    out = []
+    for size in levels:
+        level = coarsen_slices(slices, int(round(size / levels[0])), size, split_type) if size != levels[0] else slices
+        firsts, lasts, sums, counts, extra = level
+        if split_type == 'value':
+            firsts, lasts = round_edges(firsts), round_edges(lasts if clip is None else np.minimum(lasts, clip))
+        out.append(build_slices(lab, lr, nd, firsts, lasts, sums, counts, extra, stat, decimal, dtypes, count=(split_type == 'value')))
+    return out if isinstance(n_split, list) else out[0]
+
+
+def round_edges(edges, precision=3):
+    """Round edges of value increments for the range labels (as pd.cut does with default precision)"""
+
+    edges = np.asarray(edges)
+    if not np.issubdtype(edges.dtype, np.floating):
+        return edges
+    rounded = np.around(edges, precision)
+    frac, whole = np.modf(edges)
+    for i in np.flatnonzero((whole == 0) & (frac != 0)):        # keep significant digits of fractions
+        x = float(edges[i])
+        rounded[i] = np.around(x, -int(np.floor(np.log10(abs(x)))) - 1 + precision)
+    return rounded
+
+
+def slice_statistic(stat, sums, counts, extra):
+    """Compute the statistic of each column in each slice from the aggregates of slices"""
+
+    n = extra['n']                                              # counts of non-missing values (missing values are skipped as in pandas)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if stat == 'sum':
+            return sums
+        if stat in ('ave', 'mean'):
+            return sums / n
+        if stat in ('min', 'max'):
+            return np.where(n > 0, extra[stat], np.nan)
+        if stat in ('std', 'var'):                              # sample variance (as pandas does)
+            var = np.where(n > 1, extra['m2'] / (n - 1), np.nan)
+            return np.sqrt(var) if stat == 'std' else var
+        q = 0.5 if stat == 'median' else float(stat[1:]) / 100
+        return np.clip(sketch_quantiles(extra['sketch'], len(counts), sums.shape[1], q), extra['min'], extra['max'])
+
+
+def build_slices(lab, lr, nd, firsts, lasts, sums, counts, extra, stat, decimal, dtypes, count=False):
+    """Build the dataframe of slices (label, range, stats) from the aggregates of rows; multiple statistics are saved as <column>_<stat> columns"""
+
+    stats = stat if isinstance(stat, list) else [stat]
+    values = {s: slice_statistic(s, sums, counts, extra) for s in stats if s != 'count'}
+    data = {}
+    for num, col in enumerate(nd):
+        for s, vals in values.items():
+            column = pd.Series(vals[:, num])
+            if s in ('sum', 'min', 'max') and pd.api.types.is_integer_dtype(dtypes[col]) and not column.isna().any():
+                column = column.astype(np.int64)           # keep integer columns as integers (like pandas sum does)
+            data[col if len(stats) == 1 else str(col)+'_'+s] = column
+    bini = pd.DataFrame(data, index=range(len(counts))).round(decimal)
+    bini.insert(0, lr[1], pd.Series(firsts).astype(str) + '-' + pd.Series(lasts).astype(str))
+    bini.insert(0, lr[0], lab)
+    if count or 'count' in stats:
+        bini['count'] = counts
+    return bini
+
+
+def stream_resize(pieces, names, labels, ranges, stat, n_split, split_type, decimal, bounds=None):
+    """Resize data for a given label streamed as consecutive pieces, keeping only the running aggregates of the open slice"""
+
+    lr = [names[labels], names[ranges]]		# labels and ranges
+    nd = [i for i in names if not i in lr] 	# numerical data
+    levels = n_split if isinstance(n_split, list) else [n_split]
+    step = int(levels[0])
+    need = stat_needs(stat)
+    lab = None
+    dtypes = None
+    rows = 0
+    mem = 0
+    out = []                                    # finished slices
+    opened = None                               # aggregates of the open slice
+    prev = None                                 # last seen value in ranges column
+    mini = None                                 # starting edge of value increments
+    edges = None                                # edges of value increments
+    cur = 0                                     # index of the open value slice
+
+    for piece in pieces:
+        if not len(piece):
+            continue
+        if lab is None:
+            lab = piece[lr[0]].iloc[0]
+            dtypes = piece[nd].dtypes
+        rows += len(piece)
+        mem += piece.memory_usage(deep=True).sum()
+        pos = piece[lr[1]].to_numpy().astype(np.promote_types(piece[lr[1]].dtype, np.int64))      # avoid overflow of downcast positions
+        vals, ok = nan_free(piece[nd].to_numpy(dtype=np.float64))
+        if (prev is not None and pos[0] < prev) or (np.diff(pos) < 0).any():
+            logging.error('ERROR: The streaming engine requires data sorted ascending by ranges column within each label: '+str(lab))
+            sys.exit(1)
+        prev = pos[-1]
+
+        if split_type == 'value':
+            if mini is None:                    # edges of value increments are built once per label (or region)
+                mini = pos[0] if bounds is None else bounds[0]
+                edges = np.arange(mini, (pos[-1] if bounds is None else bounds[1]) + 2*levels[0], levels[0])
+            if edges[-1] < pos[-1]:             # and grown geometrically only when data goes beyond them
+                edges = np.arange(mini, mini + 2*(pos[-1] - mini) + 2*levels[0], levels[0])
+            ids = np.searchsorted(edges, pos, side='left') - 1          # right-closed intervals (as pd.cut does)
+            keep = ids >= 0
+            ids, vals, ok = ids[keep] - cur, vals[keep], ok[keep]       # numbered from the open slice
+            if not len(ids):
+                continue
+            m = ids[-1] + 1
+            firsts, lasts = edges[cur:cur + m], edges[cur + 1:cur + m + 1]
+        else:
+            ids = ((opened[3][0] if opened is not None else 0) + np.arange(len(pos))) // step
+            m = ids[-1] + 1
+            starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            firsts, lasts = pos[starts], pos[np.r_[starts[1:], len(pos)] - 1]
+        sums = np.column_stack([np.bincount(ids, weights=vals[:, c], minlength=m) for c in range(len(nd))]).reshape(m, len(nd))
+        counts = np.bincount(ids, minlength=m)
+        sliced = (firsts, lasts, sums, counts, slice_extras(ids, m, vals, sums, slice_counts(ids, m, ok), need, ok=ok))
+        if opened is not None:                  # complete the open slice with the first slice of the piece
+            sliced = combine_slices(concat_slices([opened, sliced]), np.r_[0, np.arange(m)])
+        done = m if split_type != 'value' and sliced[3][-1] == step else m - 1
+        if done:
+            out.append(range_slices(sliced, 0, done))
+        opened = range_slices(sliced, done, m) if done < m else None
+        if split_type == 'value':
+            cur += m - 1
+
+    if lab is None:
+        return None, 0, 0
+    if split_type == 'value' and mini is not None and cur + 1 >= len(np.arange(mini, prev + levels[0], levels[0])):
+        opened = None                           # the maximum fell beyond the last edge of value increments
+    if opened is not None:                      # close the last open slice
+        out.append(opened)
+    if not len(out):
+        return None, rows, mem
+    slices = concat_slices(out)
+    return finalize_slices(lab, lr, nd, slices, stat, n_split, split_type, decimal, dtypes, None if bounds is None else bounds[1]), rows, mem
+
+
+def concat_label_chunks(this_label, all_data, ranges, chunk_save, chunk_format='csv'):
 
     label_df = pd.concat(all_data)  # merge chunks with data for a given label
     mem2 = round(label_df.memory_usage(deep=True).sum()/1024/1024,2)
@@ -121,148 +1248,632 @@ def concat_label_chunks(this_label, all_data, ranges, chunk_save):
                     
     # save data chunks in the ./CHUNKS directory
     if chunk_save == 'true':
-        save_chunks(label_df, this_label)
+        save_chunks(label_df, this_label, chunk_format=chunk_format)
 
     return label_df
 
 
-def create_data_chunks(input_file, labels, ranges, llist, names, chunk_size, chunk_save, stat, split_type, n_split, decimal, output):
+def bounded_pieces(pieces, max_memory):
+    """Load pieces of a label until their memory exceeds the limit [MB]; returns the loaded pieces and whether all pieces fit in the limit"""
+
+    loaded, mem = [], 0
+    for piece in pieces:
+        loaded.append(piece)
+        mem += piece.memory_usage(deep=True).sum()
+        if mem > max_memory*1024*1024:
+            return loaded, False
+    return loaded, True
+
+
+def downcast_columns(df, names, labels, ranges, sparse=()):
+    """Downcast numerical columns to the smallest dtype that keeps values exactly (labels are kept as category, and ranges at 64 bits,
+       so arithmetic on positions does not overflow); mostly-zero columns (sparse) store only their nonzero entries"""
+
+    for col in df.columns:
+        if col in (names[labels], names[ranges]):
+            continue
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[col]):
+            small = df[col].astype(np.float32)
+            if np.array_equal(small.to_numpy(dtype=np.float64), df[col].to_numpy(), equal_nan=True):
+                df[col] = small
+        if col in sparse and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(pd.SparseDtype(df[col].dtype, 0))
+    return df
+
+
+def sparse_columns(input_file, sep, header, names, labels, ranges, threads=1, n=1000, th=0.9):
+    """Find numerical columns with at least th fraction of zeros in the sample of n first rows of the raw file"""
+
+    with open_input(input_file, threads) as handle:
+        sample = pd.read_csv(handle, nrows=n, sep=sep, header=header, names=names)
+    if not len(sample):
+        return []
+    sparse = [col for col in names if col not in (names[labels], names[ranges])
+              and pd.api.types.is_numeric_dtype(sample[col]) and (sample[col] == 0).mean() >= th]
+    logging.info('--The sparse columns held as nonzero entries only: '+str(sparse))
+    return sparse
+
+
+def dense_columns(df):
+    """Convert sparse columns back to dense ones (e.g., for binary chunks)"""
+
+    sparse = {col: df[col].dtype.subtype for col in df.columns if isinstance(df[col].dtype, pd.SparseDtype)}
+    return df.astype(sparse) if sparse else df
+
+
+def label_pieces(input_file, sep, header, names, labels, ranges, chunk_size, llist, target=0, threads=1, offset=0, shard=None, sparse=(), chunks=None):
+    """Load raw file in chunks and yield consecutive pieces of rows sharing the same label as (label, dataframe) pairs;
+       with target memory [bytes] the chunk size is re-estimated after the first chunk; reading can start at the byte offset of a row;
+       numbers of chunks with each label are collected in chunks (LABELS by default)"""
+
+    chunks = LABELS if chunks is None else chunks
+    chunk_id = 1
+    with open_input(input_file, threads) as handle:
+        if offset:
+            handle.seek(offset)
+            header = None
+        with pd.read_csv(handle, iterator=True, sep=sep, index_col=None, header=header, names=names, dtype={names[labels]: 'category'}) as reader:
+            while True:
+                try:
+                    chunk = downcast_columns(reader.get_chunk(chunk_size), names, labels, ranges, sparse)
+                except StopIteration:
+                    break
+                logging.info("1. Loading chunk: "+str(chunk_id)+' ...')
+                if target and chunk_id == 1 and len(chunk):
+                    chunk_size = max(int(target / (chunk.memory_usage(deep=True).sum() / len(chunk))), 1000)
+                    logging.info('--The re-estimated data chunk contains: '+str(chunk_size)+' rows.')
+                for lab in list(chunk[names[labels]].unique()):
+                    ### collect data for raw file stats (list of chunks for a given label)
+                    if llist != '' and lab not in llist:
+                        continue
+                    elif shard and label_shard(lab, shard[1]) != shard[0]:     # skip labels of other shards
+                        continue
+                    elif lab not in chunks:
+                        chunks[lab] = [chunk_id]
+                    elif chunk_id not in chunks[lab]:
+                        chunks[lab].append(chunk_id)
+                    yield lab, chunk.loc[chunk[names[labels]] == lab]
+                chunk_id+=1
+
+
+def tracked_pieces(source, ends, rows=0):
+    """Record the number of rows of the raw file read up to the last piece of each label (pieces keep row numbers as index)"""
+
+    for lab, piece in source:
+        if len(piece):
+            ends[lab] = rows + int(piece.index[-1]) + 1
+        yield lab, piece
+
+
+def build_label_index(input_file, sep, labels, header, block_size=16*1024*1024):
+    """Scan raw file in binary blocks and map each label to the byte ranges [start, end) and row counts of its contiguous rows"""
+
+    index = {'size': os.path.getsize(input_file), 'mtime': os.path.getmtime(input_file),
+             'sep': sep, 'labels_col': labels, 'header': header, 'labels': {}}
+    sepb = ord(sep[0])
+    cur = None                                  # [label, start, end, rows] of the current block of rows
+    with open(input_file, 'rb') as f:
+        offset = len(f.readline()) if header == 0 else 0
+        rest = b''
+        while True:
+            block = f.read(block_size)
+            data = rest + block
+            if not block and data.strip():      # the last line without end-of-line character
+                data += b'\n'
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            if cut == 0:
+                if not block:
+                    break
+                continue
+            arr = np.frombuffer(data, dtype=np.uint8, count=cut)
+            ends = np.flatnonzero(arr == 10)    # end-of-line positions
+            starts = np.concatenate(([0], ends[:-1] + 1))
+            seps = np.flatnonzero(arr == sepb)
+            first = np.searchsorted(seps, starts)
+            if labels == 0:
+                fs = starts
+            else:
+                fs = seps[np.minimum(first + labels - 1, len(seps) - 1)] + 1
+            fe = seps[np.minimum(first + labels, len(seps) - 1)] if len(seps) else ends
+            fe = np.where((first + labels < len(seps)) & (fe < ends), fe, ends)
+            lens = fe - fs
+            ### detect rows where the label differs from the previous row
+            width = max(int(lens.max()), 1)
+            cols = np.arange(width)
+            mat = np.where(cols < lens[:, None], arr[np.minimum(fs[:, None] + cols, cut - 1)], 0)
+            change = np.ones(len(starts), dtype=bool)
+            change[1:] = (lens[1:] != lens[:-1]) | (mat[1:] != mat[:-1]).any(axis=1)
+            points = np.flatnonzero(change)
+            for j, k in zip(points, np.append(points[1:], len(starts))):
+                lab = data[fs[j]:fe[j]].decode().strip()
+                start, end = offset + int(starts[j]), offset + int(ends[k-1]) + 1
+                if cur is not None and cur[0] == lab and cur[2] == start:
+                    cur[2] = end
+                    cur[3] += int(k - j)
+                else:
+                    if cur is not None:
+                        index['labels'].setdefault(cur[0], []).append(cur[1:])
+                    cur = [lab, start, end, int(k - j)]
+            offset += cut
+            if not block:
+                break
+    if cur is not None:
+        index['labels'].setdefault(cur[0], []).append(cur[1:])
+    return index
+
+
+def save_label_index(input_file, index):
+    """Save byte-offset index of labels next to the raw file as <input_file>.lidx"""
+
+    try:
+        with open(input_file + '.lidx.' + str(os.getpid()), 'w') as f:
+            json.dump(index, f)
+        os.replace(input_file + '.lidx.' + str(os.getpid()), input_file + '.lidx')     # atomic for shards building the index at once
+        logging.info("--The byte-offset index of labels saved into the file: "+str(input_file)+'.lidx')
+    except:
+        logging.warning("--The byte-offset index of labels could NOT be saved into the file: "+str(input_file)+'.lidx')
+
+
+def load_label_index(input_file, sep, labels, header):
+    """Load byte-offset index of labels if it matches the raw file (size, modification time) and parsing settings"""
+
+    try:
+        with open(input_file + '.lidx', 'r') as f:
+            index = json.load(f)
+    except:
+        return None
+    if index['size'] != os.path.getsize(input_file) or index['mtime'] != os.path.getmtime(input_file):
+        logging.info("--The byte-offset index of labels is outdated and will be rebuilt.")
+        return None
+    if index['sep'] != sep or index['labels_col'] != labels or index['header'] != header:
+        logging.info("--The byte-offset index of labels was built with different settings and will be rebuilt.")
+        return None
+    return index
+
+
+def index_pieces(input_file, index, sep, names, labels, ranges, chunk_size, llist, sparse=()):
+    """Seek directly to byte ranges of labels from the list and yield their rows as (label, dataframe) pieces of about chunk size"""
+
+    chunk_id = 1
+    llist = [str(x) for x in llist]
+    with open(input_file, 'rb') as f:
+        for lab, spans in index['labels'].items():         # keep the order of labels in the raw file
+            if lab not in llist:
+                continue
+            for start, end, rows in spans:
+                step = max(int((end - start) / rows * chunk_size), 1)
+                f.seek(start)
+                while start < end:
+                    block = f.read(min(step, end - start))
+                    if start + len(block) < end:             # cut at the last complete row
+                        block = block[:block.rfind(b'\n') + 1] or block + f.readline()
+                        f.seek(start + len(block))
+                    start += len(block)
+                    logging.info("1. Loading chunk: "+str(chunk_id)+' ...')
+                    chunk = pd.read_csv(io.BytesIO(block), sep=sep, index_col=None, header=None, names=names, dtype={names[labels]: 'category'})
+                    chunk = downcast_columns(chunk, names, labels, ranges, sparse)
+                    this_label = chunk[names[labels]].iloc[0]
+                    LABELS.setdefault(this_label, []).append(chunk_id)
+                    chunk_id+=1
+                    yield this_label, chunk
+
+
+def spilled_pieces(source, names, labels, ranges, chunk_size, sparse=()):
+    """Partition rows of the raw file (source of label pieces) into per-label spill files in a single pass, then yield (label, dataframe) for each label sorted by ranges"""
+
+    path = tempfile.mkdtemp(prefix='SPILL_', dir=os.getcwd())
+    parts = {}                                  # label: spill file (in order of the first appearance)
+    buffers = {}                                # label: list of df pieces waiting for the buffered append
+    buffered = 0
+
+    def flush():
+        for lab, dfs in buffers.items():
+            pd.concat(dfs).to_csv(parts[lab], index=False, mode='a', header=not os.path.exists(parts[lab]))
+        buffers.clear()
+
+    try:
+        logging.info("1. Partitioning data by labels into spill files in "+str(path)+' ...')
+        for lab, piece in source:
+            if lab not in parts:
+                parts[lab] = os.path.join(path, 'part_'+str(len(parts))+'.csv')
+            buffers.setdefault(lab, []).append(piece)
+            buffered += len(piece)
+            if buffered >= chunk_size:          # keep at most a chunk of rows in the buffers
+                flush()
+                buffered = 0
+        flush()
+
+        for lab, part in parts.items():
+            label_df = downcast_columns(pd.read_csv(part, dtype={names[labels]: 'category'}), names, labels, ranges, sparse)
+            os.remove(part)
+            yield lab, label_df.sort_values(by=names[ranges], kind='stable').reset_index(drop=True)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def stream_label_chunks(this_label, all_data, names, labels, ranges, chunk_save, stat, n_split, split_type, decimal, chunk_format='csv', bounds=None):
+    """Resize data for a given label on the fly, without merging its chunks in memory"""
+
+    def tee(pieces):                                        # save data chunks in the ./CHUNKS directory on the way
+        for num, piece in enumerate(pieces):
+            if chunk_save == 'true':
+                save_chunks(piece, this_label, mode='w' if num == 0 else 'a', chunk_format=chunk_format)
+            yield piece
+
+    if bounds is not None:                                  # slices are clipped to the regions of the label
+        bini, rows, mem = stream_regions(tee(all_data), names, labels, ranges, stat, n_split, split_type, decimal, bounds)
+    else:
+        bini, rows, mem = stream_resize(tee(all_data), names, labels, ranges, stat, n_split, split_type, decimal)
+    mem2 = round(mem/1024/1024,2)
+    STATS[this_label] = [rows, str(mem2)+'MB']
+    logging.info("-- the streamed data size is: "+str(rows)+' rows and '+str(mem2)+'MB')
+    return bini
+
+
+def resize_chunk_file(filename, labels, ranges, stat, n_split, split_type, decimal, engine='memory', chunk_size=0, bounds=None, stride=0):
+    """Load a single label-based chunk file and resize its data (only within the regions bounds of the label, if given)"""
+
+    if engine == 'stream' and split_type not in ('bin', 'window'):
+        if os.path.isfile(filename):
+            parts = pd.read_csv(filename, chunksize=max(chunk_size, 100000))
+        else:
+            parts = chunk_parts(filename)
+        first = next(parts)
+        names = list(first.columns)
+        if RUN_END not in names and bounds is not None:
+            pieces = (region_rows(piece, names, ranges, bounds) for piece in chain([first], parts))
+            return stream_regions(pieces, names, labels, ranges, stat, n_split, split_type, decimal, bounds)[0]
+        if RUN_END not in names:
+            return stream_resize(chain([first], parts), names, labels, ranges, stat, n_split, split_type, decimal)[0]
+        label_df = pd.concat(chain([first], parts), ignore_index=True)      # runs are compact, so they are resized in memory
+    else:
+        label_df = pd.concat(chunk_parts(filename), ignore_index=True)
+    return resize_chunk_data(label_df, labels, ranges, stat, n_split, split_type, decimal, bounds, stride)
+
+
+def resize_chunk_data(label_df, labels, ranges, stat, n_split, split_type, decimal, bounds=None, stride=0):
+    """Resize data loaded from a single label-based chunk file (only within the regions bounds of the label, if given)"""
+
+    names = list(label_df.columns)
+    resize = resize_runs if RUN_END in names else partial(resize_data, stride=stride)       # chunks saved as runs of identical rows
+    if bounds is not None:
+        label_df = region_rows(label_df, names, ranges, bounds)
+        return resize_regions(label_df, names, labels, ranges, stat, n_split, split_type, decimal, bounds, resize)
+    return resize(label_df, names, labels, ranges, stat, n_split, split_type, decimal)   # bin data for a given label
+
+
+def prefetched_chunks(input_file, files, prefetch, timing):
+    """Read and parse the next files of chunks in background threads while the current one is resized;
+       yields dataframes of files in their order, adding the time of reading and waiting for them [s] to timing"""
+
+    def read(filename):
+        start = time.perf_counter()
+        label_df = pd.concat(chunk_parts(filename), ignore_index=True)
+        return label_df, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        ahead = deque(pool.submit(read, os.path.join(input_file, ifile)) for ifile in files[:prefetch])
+        for num in range(len(files)):
+            start = time.perf_counter()
+            label_df, seconds = ahead.popleft().result()
+            timing['wait'] += time.perf_counter() - start
+            timing['read'] += seconds
+            if num + prefetch < len(files):     # keep at most prefetch files loaded ahead
+                ahead.append(pool.submit(read, os.path.join(input_file, files[num + prefetch])))
+            yield label_df
+
+
+def estimate_memory(filename, max_rows=0, n=1000):
+    """Estimate memory [MB] of the dataframe loaded from the chunk file (or its first max_rows), based on the sample of n rows"""
+
+    if os.path.isdir(filename):                 # binary columns take the same memory as on the disk
+        return sum(os.path.getsize(os.path.join(filename, f)) for f in os.listdir(filename)) / 1024 / 1024
+    sample = pd.read_csv(filename, nrows=n)
+    if not len(sample):
+        return 0
+    with open(filename, 'rb') as f:
+        head = [f.readline() for i in range(len(sample) + 1)]
+    row_bytes = sum(len(line) for line in head[1:]) / len(sample)
+    rows = (os.path.getsize(filename) - len(head[0])) / row_bytes
+    if max_rows:
+        rows = min(rows, max_rows)
+    return sample.memory_usage(deep=True).sum() / len(sample) * rows / 1024 / 1024
+
+
+def resize_chunk_files(input_file, files, labels, ranges, stat, n_split, split_type, decimal, engine, chunk_size, workers, max_memory=0, regions=None, stride=0):
+    """Resize label-based chunk files using a pool of processes, capping the memory [MB] of simultaneously loaded chunks;
+       yields resized data of files in their natural order as soon as it is ready"""
+
+    results = {}
+    ready = 0                                   # number of the next file to be yielded
+    running = {}                                # future: (file number, estimated memory)
+
+    def collect(done):
+        for future in done:
+            num, mem = running.pop(future)
+            try:
+                results[num] = future.result()
+            except:
+                logging.error('Error: Resizing data from the '+str(files[num])+' file has failed.')
+                sys.exit(1)
+            logging.info('-- resized dataframe for '+str(num)+'th label: '+str(files[num]))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for num, ifile in enumerate(files):
+            filename = os.path.join(input_file, ifile)
+            mem = 0
+            if max_memory:
+                mem = estimate_memory(filename, max(chunk_size, 100000) if engine == 'stream' and split_type not in ('bin', 'window') else 0)
+                if mem > max_memory:
+                    logging.warning('-- the '+str(ifile)+' file needs ~'+str(round(mem))+'MB, over the memory limit; it will be loaded alone.')
+            ### wait for a free worker and enough memory to load the next chunk
+            while running and (len(running) >= workers or sum(m for n, m in running.values()) + mem > max_memory > 0):
+                done, pending = wait(running, return_when=FIRST_COMPLETED)
+                collect(done)
+                while ready in results:         # keep the natural order of labels
+                    yield files[ready], results.pop(ready)
+                    ready += 1
+            logging.info('-- loading the '+str(num)+'th file: '+str(ifile)+'...')
+            bounds = regions.get(chunk_label(ifile)) if regions is not None else None
+            running[pool.submit(resize_chunk_file, filename, labels, ranges, stat, n_split, split_type, decimal, engine, chunk_size, bounds, stride)] = (num, mem)
+        while running:
+            done, pending = wait(running, return_when=FIRST_COMPLETED)
+            collect(done)
+            while ready in results:
+                yield files[ready], results.pop(ready)
+                ready += 1
+
+
+def raw_layout(input_file, names, labels, ranges, threads=1):
+    """Detect compression, delimiter, and header of the raw file; returns (compression, sep, header, names)"""
+
+    # Specify data delimiter
+    compression = input_compression(input_file)
+    if compression:
+        logging.info('--The input is '+str(compression)+' compressed and will be decompressed on the fly.')
+    sample = read_sample(input_file, threads=threads)             # get data sample
+    sep = get_delimiter(sample)
+    logging.info('--The detected data separator is: _'+str(sep)+'_')
+
+    # Specify data header (if it exists) 
+    header = None
+    head = identify_header(sample, sep=sep)
+    if len(names) != 0:				     	# use the user-provided header
+        names = names.split(',')
+        if isinstance(head[1], int):
+            if len(names) < head[1]:				## if user list is too short, append generic header
+                for i in range(head[1] - len(names)):
+                    names.append("val-"+str(i))
+        else:
+            k = len(head[1])
+            if len(names) < k:				## if user list is too short, append original
+                for i in range(k - len(names),0, -1):
+                    names.append(head[1][-i])
+        if head[0] == 'infer':
+            header = 0
+    else:							# keep the original header
+        if head[0] == 'infer':
+            header = 0
+            names = list(head[1])
+        else:						# assign the default column names
+            names = ['val-'+str(i) for i in range(head[1])]
+            try:
+                names[ranges] = 'position'
+            except:
+                pass
+            try:
+                names[labels] = 'label'
+            except:
+                pass
+    logging.info('--The assigned data header is: '+str(names))
+    return compression, sep, header, names
+
+
+def raw_chunk_size(input_file, sep, header, names, labels, ranges, chunk_size=0, max_memory=0, threads=1, sparse=()):
+    """Get the number of rows loaded at once from the raw file; returns (chunk_size, target memory [bytes] to re-estimate it)"""
+
+    # Optimize memory use when chunk size is NOT user-provided        
+    target = 0
+    if chunk_size == 0:                                       # optimize memory use to 250MB/chunk or 1/4 of the memory limit
+        target = max_memory*1024*1024/4 if max_memory else 250*1024*1024
+        with open_input(input_file, threads) as handle:
+            chunk = pd.read_csv(handle, nrows=1000, sep=sep, header=header, names=names, dtype={names[labels]: 'category'})
+        chunk = downcast_columns(chunk, names, labels, ranges, sparse)    # read col-separated data sample
+        mem = chunk.memory_usage(deep=True).sum()                  # estimate mem [bytes] for col-separated data
+        chunk_size = max(int(target / max(mem / max(len(chunk), 1), 1)), 1000)   # bytes per row (not rounded, so tiny samples work)
+        logging.info('--The optimized data chunk contains: '+str(chunk_size)+' rows of '+str(round(mem/1024, 1))+'kB per '+str(len(chunk))+' rows.')
+    else:
+        logging.info('--You requested data chunks of '+str(chunk_size)+' rows each.')
+    return chunk_size, target
+
+
+def create_data_chunks(input_file, labels, ranges, llist, names, chunk_size, chunk_save, stat, split_type, n_split, decimal, output, engine='memory', workers=1, max_memory=0, unsorted='false', chunk_format='csv', label_index='false', input_format='rows', output_format='csv', resume='false', append='false', shard=None, regions='', stride=0, prefetch=0, sparse='false'):
     """Split Big Data into the memory-affordable chunks and resize content by mean or sum of customized split size (n-bins or n-long step)."""
     
-    all_bini = []	# list of all resized df grouped by labels
+    output = re.sub(r'\.(csv|parquet)$', '', output) + shard_tag(shard)
+    writer = OutputWriter(output, n_split, output_format, keep=('true' in (resume, append)))      # resized data is appended label by label
+    if resume == 'true' and append == 'true':
+        logging.error('The resume and append modes can NOT be used together.')
+        sys.exit(1)
+    if isinstance(n_split, list) and split_type in ('bin', 'window'):
+        logging.error('The multi-resolution slicing (list of slice sizes) is available for step and value types of slicing only.')
+        sys.exit(1)
+    if split_type == 'window' and (input_format != 'rows' or 'sketch' in stat_needs(stat)):
+        logging.error('The sliding windows are available for rows of data and ave, sum, min, max, std, var, and count statistics only.')
+        sys.exit(1)
+    if not os.path.isdir(input_file) and not os.path.isfile(input_file):      # validated before any output is created
+        logging.critical('The input provided is not a file or directory with chunks.')
+        sys.exit(1)
+    if regions and not os.path.isfile(regions):
+        logging.critical('The BED file with regions does NOT exist: '+str(regions))
+        sys.exit(1)
     if llist != '':
         if os.path.isfile(llist):
             llist = [line.strip() for line in open(llist, 'r').readlines()]
         elif isinstance(llist, str):
             llist = llist.strip().split(',')
+
+    # start new outputs, or continue them from the checkpoint
+    settings = {'input': os.path.abspath(input_file), 'labels': labels, 'ranges': ranges, 'llist': llist, 'header': names, 'stat': stat, 'type': split_type,
+                'slice': n_split, 'decimal': decimal, 'unsorted': unsorted, 'label_index': label_index, 'input_format': input_format, 'output_format': output_format, 'shard': shard,
+                'regions': os.path.abspath(regions) if regions else '', 'stride': stride, 'engine': engine}
+    head = {'settings': json.loads(json.dumps(settings)), 'input': [os.path.getsize(input_file), os.path.getmtime(input_file)] if os.path.isfile(input_file) else None}
+    kept = restart_point(writer, head, resume, append)
+    if kept is None:
+        return
+    done = set(str(entry['label']) for entry in kept[1:])     # labels completed in the previous run
+    offsets = None                                              # byte offsets of rows in the plain raw file
+    bed = regions
+    regions = load_regions(bed) if bed else None                # label: sorted arrays of starts and ends of regions
         
     # process chunks from the directory
     if os.path.isdir(input_file):
         logging.info('0. Process chunks from the directory...')
         files = os.listdir(input_file)
         files = sorted(files, key=natural_sort)
+        files = [ifile for ifile in files if ifile.startswith('chunk_')]
+        if shard:
+            files = [ifile for ifile in files if label_shard(chunk_label(ifile), shard[1]) == shard[0]]
+            logging.info('--Processing '+str(len(files))+' chunks of the shard '+str(shard[0])+'/'+str(shard[1])+'.')
         if llist != '':
-            files = ['chunk_'+str(x)+'.csv' for x in llist if 'chunk_'+str(x)+'.csv' in files]
-        if len(files):
+            chunks = {chunk_label(ifile): ifile for ifile in files}
+            files = [chunks[str(x)] for x in llist if str(x) in chunks]
+        if regions is not None:
+            files = [ifile for ifile in files if chunk_label(ifile) in regions]
+        if len(files) and done:
+            files = [ifile for ifile in files if chunk_label(ifile) not in done]
+            logging.info('--Skipping '+str(len(done))+' labels completed in the previous run.')
+        if len(files) and workers > 1:
+            if prefetch > 0:
+                logging.warning('The prefetching of chunk files [-pf] is not used with parallel workers [-w]; each worker reads its own chunk files.')
+            logging.info('1. Resizing data using '+str(stat)+' on the '+str(n_split)+' '+str(split_type)+'s with '+str(workers)+' workers...')
+            for ifile, bini in resize_chunk_files(input_file, files, labels, ranges, stat, n_split, split_type, decimal, engine, chunk_size, workers, max_memory, regions, stride):
+                if bini is not None:
+                    writer.write(chunk_label(ifile), bini)
+        elif len(files):
+            loaded = None                                           # dataframes of files read ahead in background threads
+            timing = {'read': 0, 'wait': 0}
+            if prefetch > 0 and engine == 'stream' and split_type not in ('bin', 'window'):
+                logging.warning('The prefetching of chunk files is available for the memory engine only; the stream engine reads them on the fly.')
+            elif prefetch > 0:
+                logging.info('--Prefetching up to '+str(prefetch)+' chunk files ahead...')
+                loaded = prefetched_chunks(input_file, files, prefetch, timing)
             for num,ifile in enumerate(files):
-                if ifile.startswith('chunk_'):
-                    logging.info('1. Loading the '+str(num)+'th file: '+str(ifile)+'...')
-                    label_df = pd.read_csv(os.path.join(input_file, ifile))
-                    names = list(label_df.columns)
-                    logging.info('2. Resizing data using '+str(stat)+' on the '+str(n_split)+' '+str(split_type)+'s...')
-                    try:
-                        bini = resize_data(label_df, names, labels, ranges, stat, n_split, split_type, decimal)   # bin data for a given label
-                    except:
-                        logging.error('Error: To aggregate data you need to specify column indexes with labels [-l] and ranges [-r].')
-                        sys.exit(1)
-                    logging.info('3. Appending resized dataframe for '+str(num)+'th label...')
-                    all_bini.append(bini)
-        else:
+                logging.info('1. Loading the '+str(num)+'th file: '+str(ifile)+'...')
+                logging.info('2. Resizing data using '+str(stat)+' on the '+str(n_split)+' '+str(split_type)+'s...')
+                try:
+                    bounds = regions.get(chunk_label(ifile)) if regions is not None else None
+                    if loaded is not None:
+                        bini = resize_chunk_data(next(loaded), labels, ranges, stat, n_split, split_type, decimal, bounds, stride)
+                    else:
+                        bini = resize_chunk_file(os.path.join(input_file, ifile), labels, ranges, stat, n_split, split_type, decimal, engine, chunk_size, bounds, stride)
+                except:
+                    logging.error('Error: To aggregate data you need to specify column indexes with labels [-l] and ranges [-r].')
+                    sys.exit(1)
+                logging.info('3. Appending resized dataframe for '+str(num)+'th label...')
+                if bini is not None:
+                    writer.write(chunk_label(ifile), bini)
+            if loaded is not None:
+                logging.info('--Reading chunk files took '+str(round(timing['read'], 2))+'s, of which '+str(round(max(timing['read'] - timing['wait'], 0), 2))+'s of I/O wait was hidden by prefetching (waited '+str(round(timing['wait'], 2))+'s).')
+        elif not done:
             logging.error('There are NO chunks for the labels in the list! '+str(llist))
         
     # create and process chunks from raw file
     elif os.path.isfile(input_file):
         logging.info('0. Process raw input file...')
 
-        # Specify data delimiter
-        chunk = pd.read_csv(input_file, nrows=100)		         # get data sample
-        chunk.to_csv('chunk.csv', index=False)
-        sep = get_delimiter('chunk.csv')                             
-        logging.info('--The detected data separator is: _'+str(sep)+'_')
-
-        # Specify data header (if it exists) 
-        header = None
-        head = identify_header('chunk.csv', sep=sep)
-        if len(names) != 0:				     	# use the user-provided header
-            names = names.split(',')
-            if isinstance(head[1], int):
-                if len(names) < head[1]:				## if user list is too short, append generic header
-                    for i in range(head[1] - len(names)):
-                        names.append("val-"+str(i))
-            else:
-                k = len(head[1])
-                if len(names) < k:				## if user list is too short, append original
-                    for i in range(k - len(names),0, -1):
-                        names.append(head[1][-i])
-            if head[0] == 'infer':
-                header = 0
-        else:							# keep the original header
-            if head[0] == 'infer':
-                header = 0
-                names = list(head[1])
-            else:						# assign the default column names
-                names = ['val-'+str(i) for i in range(head[1])]
-                try:
-                    names[ranges] = 'position'
-                except:
-                    pass
-                try:
-                    names[labels] = 'label'
-                except:
-                    pass
-        logging.info('--The assigned data header is: '+str(names))
-
-        chunk_id = 1
-        # Optimize memory use when chunk size is NOT user-provided        
-        if chunk_size == 0:                                       # optimize memory use to 250MB/chunk
-            chunk = pd.read_csv(input_file, nrows=1000, sep=sep)     # read col-separated data sample
-            mem = round(chunk.memory_usage(deep=True).sum()/1024,0)  # estimate mem [kB] for col-separated data
-            chunk_size = round(250000/mem)*1000
-            logging.info('--The optimized data chunk contains: '+str(chunk_size)+' rows of '+str(mem)+'kB in total.')
-        else:
-            logging.info('--You requested data chunks of '+str(chunk_size)+' rows each.')
+        compression, sep, header, names = raw_layout(input_file, names, labels, ranges, workers)
+        sparse = sparse_columns(input_file, sep, header, names, labels, ranges, workers) if sparse == 'true' else []
+        chunk_size, target = raw_chunk_size(input_file, sep, header, names, labels, ranges, chunk_size, max_memory, workers, sparse)
 
         # Parse data
         all_data = []						     # list of all matching df chunks
-        label_df = pd.DataFrame()                                    # creates a new empty dataframe for each label
-        this_label = ''
         ## load data from chunks and merge them by labels
-        for chunk in pd.read_csv(input_file, chunksize=chunk_size, sep=sep, index_col=None, header=header, names=names):
-            logging.info("1. Loading chunk: "+str(chunk_id)+' ...')            
-            for lab in list(chunk[names[labels]].unique()):
-                ### collect data for raw file stats (list of chunks for a given label)
-                if llist != '' and lab not in llist:
+        index = None
+        if label_index == 'true' and compression:
+            logging.warning('The byte-offset index of labels is not available for compressed inputs; the whole file will be scanned.')
+        elif (label_index == 'true' or shard) and not compression:   # labels of the shard are read directly using the index
+            index = load_label_index(input_file, sep, labels, header)
+            if index is None:
+                logging.info("--Building the byte-offset index of labels for the raw file...")
+                index = build_label_index(input_file, sep, labels, header)
+                save_label_index(input_file, index)
+        if shard and index is not None:
+            llist = [lab for lab in index['labels'] if label_shard(lab, shard[1]) == shard[0] and (llist == '' or lab in llist)]
+            logging.info('--Processing '+str(len(llist))+' labels of the shard '+str(shard[0])+'/'+str(shard[1])+'.')
+        if regions is not None:                                     # only labels with regions are read
+            llist = [lab for lab in (index['labels'] if index is not None else regions) if lab in regions and (llist == '' or lab in llist)]
+        ## plain raw file read sequentially is checkpointed with the byte offset of rows after each completed label (when resume or append needs them)
+        ends = {}                                                   # label: number of rows read up to its last piece
+        start = kept[-1] if len(kept) > 1 else {}
+        if not compression and unsorted != 'true' and (index is None or llist == '') and 'true' in (resume, append):
+            with open(input_file, 'rb') as f:
+                if header == 0:
+                    f.readline()
+                offsets = RowOffsets(input_file, start.get('offset', f.tell()), start.get('rows', 0))
+        if index is not None and llist != '':
+            logging.info("--Reading labels from the list directly using the byte-offset index...")
+            pieces = index_pieces(input_file, index, sep, names, labels, ranges, chunk_size, llist, sparse)
+        elif offsets is not None:
+            if 'offset' in start:
+                logging.info("--Reading the raw file from the byte offset "+str(offsets.offset)+'...')
+            pieces = tracked_pieces(label_pieces(input_file, sep, header, names, labels, ranges, chunk_size, llist, target, workers, offsets.offset if 'offset' in start else 0, shard, sparse), ends, offsets.rows)
+        else:
+            pieces = label_pieces(input_file, sep, header, names, labels, ranges, chunk_size, llist, target, workers, 0, shard, sparse)
+        if done:                                                    # skip labels completed in the previous run (saved without byte offsets)
+            pieces = ((lab, piece) for lab, piece in pieces if str(lab) not in done)
+        if regions is not None and input_format == 'rows':          # drop rows outside regions before they are merged
+            pieces = region_pieces(pieces, names, ranges, regions)
+        if unsorted == 'true':
+            pieces = spilled_pieces(pieces, names, labels, ranges, chunk_size, sparse)
+        if input_format != 'rows':
+            logging.info("--Collapsing consecutive identical rows into runs...")
+            pieces = run_pieces(pieces, names, labels, ranges, input_format)
+            if regions is not None:
+                pieces = region_pieces(pieces, names, ranges, regions)
+        for this_label, group in groupby(pieces, key=lambda x: x[0]):
+            logging.info("2. Creating dataframe for a label: "+str(this_label)+'...')
+            all_data = (piece for lab, piece in group)
+            streamable = split_type not in ('bin', 'window') and input_format == 'rows'
+            stream = engine == 'stream' and streamable
+            if max_memory and not stream:                          # the memory limit is checked before pieces of a label are merged
+                loaded, fits = bounded_pieces(all_data, max_memory)
+                if not fits and not streamable:
+                    logging.error('The data for a label '+str(this_label)+' exceeds the memory limit; '+str(split_type)+' slices of '+str(input_format)+' need all data of a label loaded at once.')
+                    sys.exit(1)
+                if not fits:
+                    logging.warning('The data for a label '+str(this_label)+' exceeds the memory limit; it is resized with the stream engine.')
+                    stream = True
+                all_data = chain(loaded, all_data)
+            if stream:
+                logging.info("3. Resizing streamed data for a label: "+str(this_label)+'...')
+                bini = stream_label_chunks(this_label, all_data, names, labels, ranges, chunk_save, stat, n_split, split_type, decimal, chunk_format, regions[str(this_label)] if regions is not None else None)
+            else:
+                label_df = concat_label_chunks(this_label, list(all_data), names[ranges], chunk_save, chunk_format)
+                if input_format != 'rows':                          # merge runs split between pieces
+                    label_df = collapse_runs(label_df, names, labels, ranges)
+                # bin data for a given label
+                try:
+                    logging.info("3. Resizing dataframe for a label: "+str(this_label)+'...')
+                    resize = resize_runs if input_format != 'rows' else partial(resize_data, stride=stride)
+                    if regions is not None:                         # slices are clipped to the regions of the label
+                        bini = resize_regions(label_df, names, labels, ranges, stat, n_split, split_type, decimal, regions[str(this_label)], resize)
+                    else:
+                        bini = resize(label_df, names, labels, ranges, stat, n_split, split_type, decimal)
+                except:
+                    logging.error("ERROR: Aggregating data over slices has failed!")
                     continue
-                elif lab not in LABELS:
-                    LABELS[lab] = [chunk_id]
-                elif chunk_id not in LABELS[lab]:
-                    LABELS[lab].append(chunk_id)
-                
-                ### collect data for a given label (merge chunks by label)
-                if this_label == '':
-                    this_label = lab
-                    logging.info("2. Creating dataframe for a label: "+str(this_label)+'...')
-                    all_data.append(chunk.loc[chunk[names[labels]] == this_label])
-                elif this_label == lab:		# append all label-matching rows from the chunk
-                    all_data.append(chunk.loc[chunk[names[labels]] == this_label])
-                else:                               # resize data for this_label and begin cycle for next label
-                    label_df = concat_label_chunks(this_label, all_data, names[ranges], chunk_save)
-    
-                    # bin data for a given label
-                    try:
-                        logging.info("3. Resizing dataframe for a label: "+str(this_label)+'...')
-                        bini = resize_data(label_df, names, labels, ranges, stat, n_split, split_type, decimal)
-                        logging.info("-- a new dataframe size is: "+str(len(bini))+' rows, resized by '+str(stat)+' on '+str(n_split)+' '+str(split_type)+'s')
-                        all_bini.append(bini)
-                    except:
-                        logging.error("ERROR: Aggregating data over slices has failed!")
-
-                    # begin cycle for next label
-                    this_label = lab
-                    logging.info("2. Creating dataframe for a label: "+str(this_label)+'...')
-                    all_data = []
-                    all_data.append(chunk.loc[chunk[names[labels]] == this_label])
-            chunk_id+=1
-        # bin data for the last label
-        label_df = concat_label_chunks(this_label, all_data, names[ranges], chunk_save)
-        logging.info("3. Resizing dataframe for a label: "+str(this_label)+'...')
-        bini = resize_data(label_df, names, labels, ranges, stat, n_split, split_type, decimal)
-        logging.info("-- a new dataframe size is: "+str(len(bini))+' rows, resized by '+str(stat)+' on '+str(n_split)+' '+str(split_type)+'s')
-        all_bini.append(bini)
+            if bini is not None:
+                logging.info("-- a new dataframe size is: "+str(len(bini[0] if isinstance(bini, list) else bini))+' rows, resized by '+str(stat)+' on '+str(n_split)+' '+str(split_type)+'s')
+                state = {'rows': ends[this_label], 'offset': offsets.advance(ends[this_label])} if offsets is not None else {}
+                writer.write(this_label, bini, state)
         
         try:
-            logging.info("Saving statistics of a raw file into the label_in_chunks.txt ...")
-            f = open("label_in_chunks.txt", "w")
+            logging.info("Saving statistics of a raw file into the label_in_chunks"+shard_tag(shard)+".txt ...")
+            f = open("label_in_chunks"+shard_tag(shard)+".txt", "w")
             for lab in LABELS.keys():
                 try:
                     f.write(str(lab)+","+str(STATS[lab][0])+","+str(STATS[lab][1])+","+str(LABELS[lab])+'\n')
@@ -272,20 +1883,114 @@ def create_data_chunks(input_file, labels, ranges, llist, names, chunk_size, chu
             f.close()
         except:
             pass
-        
-        if os.path.isfile('chunk.csv'):
-            os.remove('chunk.csv')
 
     else:
         logging.critical('The input provided is not a file or directory with chunks.')
         sys.exit(1)
 
-    # save aggregated output
-    if len(all_bini):
-        if not output.endswith('.csv'):
-            output = output + '.csv'
-        logging.info("4. Saving resized data into the "+str(output)+" file ...")
-        pd.concat(all_bini).to_csv(output, index=False, mode='w', header=not os.path.exists(output))
+    # rename complete output
+    state = {}
+    if offsets is not None:                                     # the end of the raw file for the append mode
+        with offsets:
+            offset = offsets.advance(np.inf)
+        state = {'rows': offsets.rows, 'offset': offset, 'crc': tail_crc(input_file, offset)}
+    if not writer.close(state):
+        logging.warning('There is NO resized data to be saved.')
+
+
+def sample_name(input_file, taken):
+    """Get a unique name of the sample from its input file (without extensions of compression and format)"""
+
+    name = re.sub(r'\.(gz|bgz|zst)$', '', os.path.basename(input_file))
+    name = os.path.splitext(name)[0] or name
+    return name + '_' + str(len(taken)) if name in taken else name
+
+
+def sample_slices(input_file, labels, ranges, llist, names, chunk_size, stat, size, unsorted='false', max_memory=0, engine='memory', chunk_save='false', chunk_format='csv', sample=''):
+    """Read a single sample file and aggregate rows of each label into slices of the shared grid of value increments anchored at 0
+       (the stream engine adds pieces of rows to the grid one by one, without merging them); label-based chunks are saved into CHUNKS/{sample};
+       returns slices by labels (in order of the first appearance), names of labels and ranges columns, types of numerical columns,
+       and statistics of labels (rows, memory, numbers of chunks)"""
+
+    compression, sep, header, names = raw_layout(input_file, names, labels, ranges)
+    chunk_size, target = raw_chunk_size(input_file, sep, header, names, labels, ranges, chunk_size, max_memory)
+    lr = [names[labels], names[ranges]]		# labels and ranges
+    nd = [i for i in names if not i in lr] 	# numerical data
+    need = stat_needs(stat)
+    out = {}
+    chunks = {}                                 # label: numbers of chunks with the label
+    stats = {}                                  # label: [rows, memory]
+    dtypes = pd.Series(np.dtype(np.float64), index=nd)
+    pieces = label_pieces(input_file, sep, header, names, labels, ranges, chunk_size, llist, target, chunks=chunks)
+    if unsorted == 'true':
+        pieces = spilled_pieces(pieces, names, labels, ranges, chunk_size)
+    for lab, group in groupby(pieces, key=lambda x: x[0]):
+        parts = (piece for l, piece in group) if engine == 'stream' else [pd.concat([piece for l, piece in group])]
+        for label_df in parts:
+            if chunk_save == 'true':
+                save_chunks(label_df, lab, mode='a' if lab in out else 'w', chunk_format=chunk_format, path=os.path.join('CHUNKS', sample))
+            rows, mem = stats.get(lab, [0, 0])
+            stats[lab] = [rows + len(label_df), mem + label_df.memory_usage(deep=True).sum()]
+            dtypes = label_df[nd].dtypes
+            pos = label_df[lr[1]].to_numpy()
+            edges = np.arange(0, pos.max() + size, size)
+            slices = value_slices(pos, label_df[nd].to_numpy(dtype=np.float64), edges, need)
+            if lab in out:                      # fragments (or pieces) of the label are merged on the shared grid
+                edges = np.arange(max(len(edges), len(out[lab][3]) + 1)) * size
+                slices = add_slices(pad_slices(out[lab], edges, len(nd), need), pad_slices(slices, edges, len(nd), need))
+            out[lab] = slices
+    logging.info('-- the sample '+str(input_file)+' is aggregated for '+str(len(out))+' labels.')
+    return out, lr, dtypes, {lab: stats[lab] + [chunks.get(lab, [])] for lab in out}
+
+
+def create_sample_matrix(input_files, labels, ranges, llist, names, chunk_size, stat, split_type, n_split, decimal, output, workers=1, max_memory=0, unsorted='false', output_format='csv', engine='memory', chunk_save='false', chunk_format='csv'):
+    """Resize data of multiple samples concurrently on the shared grid of value increments and save them as a single wide matrix of slices by samples"""
+
+    if split_type != 'value':
+        logging.error('The multi-sample matrix requires the shared grid of value increments [-t value].')
+        sys.exit(1)
+    if llist != '':
+        if os.path.isfile(llist):
+            llist = [line.strip() for line in open(llist, 'r').readlines()]
+        elif isinstance(llist, str):
+            llist = llist.strip().split(',')
+    samples = []
+    for input_file in input_files:
+        if not os.path.isfile(input_file):
+            logging.critical('The input provided is not a file: '+str(input_file))
+            sys.exit(1)
+        samples.append(sample_name(input_file, samples))
+    levels = n_split if isinstance(n_split, list) else [n_split]
+    need = stat_needs(stat)
+
+    # reading, decompression, and parsing of sample files overlap in threads
+    threads = workers if workers > 1 else min(len(input_files), os.cpu_count() or 1)
+    logging.info('1. Resizing '+str(len(input_files))+' samples using '+str(threads)+' threads...')
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda f, sample: sample_slices(f, labels, ranges, llist, names, chunk_size, stat, levels[0], unsorted, max_memory / threads, engine, chunk_save, chunk_format, sample),
+                                input_files, samples))
+
+    writer = OutputWriter(output, n_split, output_format)
+    writer.begin({'settings': {'input': [os.path.abspath(f) for f in input_files]}, 'input': None})
+    order = list(dict.fromkeys(lab for out, lr, dtypes, stats in results for lab in out))      # labels in order of the first appearance
+    for lab in order:
+        logging.info("2. Creating the matrix of samples for a label: "+str(lab)+'...')
+        m = max(len(out[lab][3]) for out, lr, dtypes, stats in results if lab in out)
+        edges = np.arange(m + 1) * levels[0]
+        tables = []
+        for sample, (out, lr, dtypes, stats) in zip(samples, results):
+            bini = finalize_slices(lab, lr, list(dtypes.index), pad_slices(out.get(lab), edges, len(dtypes), need), stat, n_split, 'value', decimal, dtypes)
+            tables.append([df.rename(columns={col: sample+'_'+str(col) for col in df.columns[2:]}) for df in (bini if isinstance(bini, list) else [bini])])
+        matrix = [pd.concat([tables[0][num]] + [table[num].iloc[:, 2:] for table in tables[1:]], axis=1) for num in range(len(levels))]
+        writer.write(lab, matrix if isinstance(n_split, list) else matrix[0])
+    if not writer.close():
+        logging.warning('There is NO resized data to be saved.')
+
+    for sample, (out, lr, dtypes, stats) in zip(samples, results):
+        logging.info("Saving statistics of a raw file into the label_in_chunks_"+sample+".txt ...")
+        with open("label_in_chunks_"+sample+".txt", "w") as f:
+            for lab, (rows, mem, chunks) in stats.items():
+                f.write(str(lab)+","+str(rows)+","+str(round(mem/1024/1024, 2))+"MB,"+str(chunks)+'\n')
 
 
 ###-- add options to the argument parser to make it easier to customize and run the script from the command line
@@ -299,7 +2004,7 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '-i', '--data-source',
-        help='[string] input multi-col file or directory with data chunks',
+        help='[string] input multi-col file or directory with data chunks;\ncomma-separated list of files returns the matrix of samples on the shared grid (-t value)',
         metavar='input',
         dest='input',
         type=str,
@@ -328,6 +2033,20 @@ if __name__ == '__main__':
         dest='llist',
         default=''
     )
+    parser.add_argument(
+        '-rg', '--regions',
+        help='provide BED file with regions (label, 0-based start, end); only rows within regions are resized and slices are clipped to region boundaries; default='' means no regions',
+        metavar='regions',
+        dest='regions',
+        default=''
+    )
+    parser.add_argument(
+        '-ix', '--label-index',
+        help='builds (or reuses) byte-offset index of labels in the raw file, saved as <input>.lidx, to read labels from the list directly [default: off]',
+        choices=['true', 'false'],
+        default='false',
+        dest='index'
+    )
     parser.add_argument(
         '-hd', '--header',
         help='provide custom list of columns names (header); [comma-separated string]',
@@ -351,28 +2070,96 @@ if __name__ == '__main__':
         default='true',
         dest='save'
     )
+    parser.add_argument(
+        '-sf', '--chunk-format',
+        help='select format of saved chunks: csv, npy (directory of binary columns, memory-mapped at reload) or parquet (requires pyarrow) [default: csv]',
+        choices=CHUNK_FORMATS,
+        default='csv',
+        dest='chunk_format'
+    )
+    parser.add_argument(
+        '-u', '--unsorted',
+        help='partitions rows of unsorted raw file (labels not in contiguous blocks) into per-label spill files before resizing [default: off]',
+        choices=['true', 'false'],
+        default='false',
+        dest='unsorted'
+    )
+    parser.add_argument(
+        '-sp', '--sparse',
+        help='holds numerical columns with at least 90%% of zeros in the sample of raw file as sparse columns (nonzero entries only) [default: off]',
+        choices=['true', 'false'],
+        default='false',
+        dest='sparse'
+    )
+    parser.add_argument(
+        '-if', '--input-format',
+        help='select format of raw file: rows, runs (collapse consecutive identical rows into runs at read time) or bedgraph (intervals: label, start, end, values) [default: rows]',
+        choices=INPUT_FORMATS,
+        default='rows',
+        dest='input_format'
+    )
     parser.add_argument(
          '-c', '--calc-stats', 
-         help="select resizing opeartion: ave (mean) or sum",
-         choices=['ave', 'sum'],
+         help="select resizing opeartion: ave (mean), sum, min, max, std, var, count, median or qXX (XX-th percentile);\ncomma-separated list of statistics returns all of them in a single pass as <column>_<stat> columns",
+         type=calc_stats,
          default='ave', 
+         metavar='calc',
          dest='calc'         
     )
     parser.add_argument(
          '-t', '--slice-type', 
-         help="select type of slicing: step (number of rows in a slice) or bin (number of slices) or value (value increment in ranges col)",
-         choices=['step', 'bin', 'value'],
+         help="select type of slicing: step (number of rows in a slice) or bin (number of slices) or value (value increment in ranges col)\nor window (number of rows in overlapping windows sliding by stride rows)",
+         choices=['step', 'bin', 'value', 'window'],
          default='step',
          dest='type'         
     )
     parser.add_argument(
          '-n', '--slice-size', 
-         help="select size of slicing",
-         type=float,
+         help="select size of slicing; comma-separated list of sizes (multiples of the smallest one) returns all resolutions in a single run",
+         type=slice_sizes,
          default=100,
          metavar='slice',
          dest='slice'         
     )
+    parser.add_argument(
+         '-sd', '--stride', 
+         help="select number of rows between starts of consecutive windows (-t window); default=0 means the window size (no overlap)",
+         type=int,
+         default=0,
+         metavar='stride',
+         dest='stride'         
+    )
+    parser.add_argument(
+         '-e', '--engine', 
+         help="select resizing engine: memory (merge all chunks of a label before slicing) or stream (slice data on the fly with running sums; requires data sorted by ranges column within labels)",
+         choices=['memory', 'stream'],
+         default='memory', 
+         dest='engine'         
+    )
+    parser.add_argument(
+         '-w', '--workers', 
+         help="provide number of parallel processes used to resize chunks from the directory (or threads decompressing bgzip raw file)",
+         type=int,
+         default=1,
+         metavar='workers',
+         dest='workers'         
+    )
+    parser.add_argument(
+         '-pf', '--prefetch', 
+         help="provide number of chunk files from the directory read ahead in background threads while the current one is resized; default=0 means no prefetching",
+         type=int,
+         default=0,
+         metavar='prefetch',
+         dest='prefetch'         
+    )
+    parser.add_argument(
+         '-mm', '--max-memory', 
+         help="provide memory limit [MB] for data chunks loaded at the same time; with automatic chunk size [-ch 0], raw file is read in chunks of 1/4 of the limit; default=0 means no limit",
+         type=float,
+         default=0,
+         metavar='mem',
+         dest='mem'         
+    )
     parser.add_argument(
          '-d', '--decimal-out', 
          help="provide decimal places for numerical outputs",
@@ -389,6 +2176,35 @@ if __name__ == '__main__':
          metavar='out',
          dest='out'         
     )
+    parser.add_argument(
+        '-rs', '--resume',
+        help='continues the interrupted run after the labels recorded in the checkpoint manifest <output>.ckpt [default: off]',
+        choices=['true', 'false'],
+        default='false',
+        dest='resume'
+    )
+    parser.add_argument(
+        '-ap', '--append',
+        help='resizes only the rows added to the raw file since the previous complete run and merges them into its output [default: off]',
+        choices=['true', 'false'],
+        default='false',
+        dest='append'
+    )
+    parser.add_argument(
+        '-sh', '--shard',
+        help='processes only labels of the i-th of N shards (numbered from 0) assigned by a stable hash of labels, e.g., 0/4;\nthe outputs of all shards are combined with: bin_data.py merge -o out',
+        type=shard_spec,
+        default=None,
+        metavar='shard',
+        dest='shard'
+    )
+    parser.add_argument(
+        '-of', '--output-format',
+        help='select format of output: csv or parquet (directory of parquet files, one per label) [default: csv]',
+        choices=OUTPUT_FORMATS,
+        default='csv',
+        dest='output_format'
+    )
     parser.add_argument(
          '-v', '--verbose', 
          const=1, 
@@ -400,6 +2216,34 @@ if __name__ == '__main__':
 
 
 
+###-- merge outputs of shards with the companion subcommand: bin_data.py merge -o out
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        merger = argparse.ArgumentParser(
+            prog='bin_data.py merge',
+            description="""Merge outputs and statistics of all shards (-sh i/N) into a single output in natural order of labels.""",
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        merger.add_argument(
+             '-o', '--output', 
+             help="provide output filename used by shards",
+             type=str,
+             default='output_data',
+             metavar='out',
+             dest='out'         
+        )
+        merger.add_argument(
+             '-v', '--verbose', 
+             const=1, 
+             default=0, 
+             type=int, 
+             nargs="?",
+             help="increase verbosity: 0 = warnings, 1 = info, 2 = rich info"
+        )
+        args = merger.parse_args(sys.argv[2:])
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARN)
+        merge_shards(args.out)
+        sys.exit(0)
+
 ###-- print example of usage and help message when script is run without required arguments
     if len(sys.argv) < 3:
         parser.print_help()
@@ -407,7 +2251,12 @@ if __name__ == '__main__':
         print("e.g., minimal required inputs:\n 	python3 bin_data.py -i input_file -l 0 -r 1 \n")
         print("e.g., using raw input file:\n 	python3 bin_data.py -i hybrid.depth -l 0 -r 1 -t 'step' -n 1000 -s True -v 1 \n")
         print("e.g., using directory of chunks:\n 	python3 bin_data.py -i CHUNKS/ -l 0 -r 1 -t 'value' -n 0.15 -s False -v 0 \n")
-        print("e.g., using default settings:\n 	python3 bin_data.py -i {path} -l {int} -r {int} -ll '' -hd '' -ch 0 -s True -c 'ave' -t 'step' -n 100 -d 2 -o 'output_data' -v 0 \n")
+        print("e.g., using multi-resolution slicing:\n 	python3 bin_data.py -i hybrid.depth -l 0 -r 1 -t 'value' -n 1000,10000,100000 -e 'stream' -v 1 \n")
+        print("e.g., using parallel workers for directory of chunks:\n 	python3 bin_data.py -i CHUNKS/ -l 0 -r 1 -t 'step' -n 1000 -w 16 -mm 32000 -v 1 \n")
+        print("e.g., using sliding windows:\n 	python3 bin_data.py -i hybrid.depth -l 0 -r 1 -t 'window' -n 1000 -sd 100 -c 'ave,count' -v 1 \n")
+        print("e.g., using regions from the BED file:\n 	python3 bin_data.py -i hybrid.depth -l 0 -r 1 -rg genes.bed -t 'value' -n 1000 -v 1 \n")
+        print("e.g., using shards of labels (run for i = 0..3, then merge):\n 	python3 bin_data.py -i hybrid.depth -l 0 -r 1 -sh i/4 -o depth && python3 bin_data.py merge -o depth \n")
+        print("e.g., using default settings:\n 	python3 bin_data.py -i {path} -l {int} -r {int} -ll '' -rg '' -ix False -hd '' -ch 0 -s True -sf 'csv' -u False -sp False -if 'rows' -c 'ave' -t 'step' -n 100 -sd 0 -e 'memory' -w 1 -pf 0 -mm 0 -d 2 -o 'output_data' -of 'csv' -rs False -ap False -v 0 \n")
         sys.exit(1)
 
     args = parser.parse_args()
@@ -419,4 +2268,11 @@ if __name__ == '__main__':
     elif args.verbose == 2:
         logger.setLevel(logging.DEBUG) 
     
-    create_data_chunks(args.input, args.label, args.range, args.llist, args.header, args.chunks, args.save, args.calc, args.type, args.slice, args.dec, args.out)
+    inputs = args.input.split(',') if not os.path.exists(args.input) else [args.input]
+    if len(inputs) > 1:                         # multi-sample matrix on the shared grid
+        if args.regions:
+            logging.error('The regions [-rg] are not available for the matrix of multiple samples.')
+            sys.exit(1)
+        create_sample_matrix(inputs, args.label, args.range, args.llist, args.header, args.chunks, args.calc, args.type, args.slice, args.dec, args.out, args.workers, args.mem, args.unsorted, args.output_format, args.engine, args.save, args.chunk_format)
+        sys.exit(0)
+    create_data_chunks(args.input, args.label, args.range, args.llist, args.header, args.chunks, args.save, args.calc, args.type, args.slice, args.dec, args.out, args.engine, args.workers, args.mem, args.unsorted, args.chunk_format, args.index, args.input_format, args.output_format, args.resume, args.append, args.shard, args.regions, args.stride, args.prefetch, args.sparse)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gzip
+import zlib
+import struct
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import bin_data
+
+NAMES = ['label', 'pos', 'x', 'y']
+
+
+def label_data():
+    """Single label with a missing value in the column x of the first slice"""
+
+    return pd.DataFrame({'label': 'a', 'pos': np.arange(1, 11),
+                         'x': [0.1, 0.2, np.nan, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+                         'y': [1, 2, 3, 3, 3, 4, 4, 4, 4, 4]}, columns=NAMES)
+
+
+def test_step_slices_skip_missing_values():
+    df = label_data()
+    ave = bin_data.resize_data(df.copy(), NAMES, 0, 1, 'ave', 5, 'step', 2)
+    assert ave.iloc[0].tolist() == ['a', '1-5', 0.3, 2.4]
+    total = bin_data.resize_data(df.copy(), NAMES, 0, 1, 'sum', 5, 'step', 2)
+    assert total.iloc[0].tolist() == ['a', '1-5', 1.2, 12]
+    stats = bin_data.resize_data(df.copy(), NAMES, 0, 1, ['min', 'max', 'std'], 5, 'step', 2)
+    ref = df.iloc[:5][['x', 'y']].agg(['min', 'max', 'std']).round(2)
+    assert stats.iloc[0][['x_min', 'x_max', 'x_std']].tolist() == ref['x'].tolist()
+
+
+def test_value_slices_skip_missing_values():
+    df = label_data()
+    out = bin_data.resize_data(df.copy(), NAMES, 0, 1, 'ave', 5, 'value', 4)
+    ref = df.groupby(pd.cut(df['pos'], np.arange(1, 15, 5)), observed=False)[['x', 'y']].mean().round(4)
+    assert out[['x', 'y']].to_numpy().tolist() == ref.to_numpy().tolist()
+    assert out['count'].tolist() == [5, 4]
+
+
+def test_stream_engine_skips_missing_values():
+    df = label_data()
+    pieces = (df.iloc[a:a + 3].reset_index(drop=True) for a in range(0, len(df), 3))
+    out, rows, mem = bin_data.stream_resize(pieces, NAMES, 0, 1, ['ave', 'std'], 5, 'step', 4)
+    ref = bin_data.resize_data(df.copy(), NAMES, 0, 1, ['ave', 'std'], 5, 'step', 4)
+    assert rows == len(df)
+    assert out.equals(ref)
+    assert out.iloc[0]['x_ave'] == 0.3
+
+
+def test_stream_value_slices_of_downcast_positions():
+    df = pd.DataFrame({'label': 'a', 'pos': np.arange(1, 30001), 'x': np.arange(30000) % 7}, columns=['label', 'pos', 'x'])
+    pieces = (df.iloc[a:a + 1000].reset_index(drop=True).astype({'pos': np.int16}) for a in range(0, len(df), 1000))
+    out, rows, mem = bin_data.stream_resize(pieces, ['label', 'pos', 'x'], 0, 1, 'ave', 100, 'value', 4)
+    ref = bin_data.resize_data(df.copy(), ['label', 'pos', 'x'], 0, 1, 'ave', 100, 'value', 4)
+    assert len(out) == 300
+    assert out.equals(ref)
+
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'bin_data.py')
+
+
+def run(cwd, *args):
+    """Run bin_data.py with the options in the working directory (chunks are not saved unless -s is given)"""
+
+    args = [str(arg) for arg in args]
+    return subprocess.run([sys.executable, APP] + (args if '-s' in args else args + ['-s', 'false']), check=True, cwd=cwd, capture_output=True, text=True)
+
+
+def raw_file(path, labels='abc', rows=60):
+    """Write the raw file with the label, position, depth-like and fractional columns"""
+
+    path.write_text(''.join(lab+','+str(p)+','+str((p // 4) % 5)+','+str(round(p * 0.37 % 1, 2))+'\n' for lab in labels for p in range(1, rows + 1)))
+    return path
+
+
+def test_default_chunk_size_on_small_input(tmp_path):
+    data = tmp_path / 'tiny.csv'
+    data.write_text(''.join('a,'+str(p)+','+str(p % 3)+'\n' for p in range(1, 21)))
+    out = tmp_path / 'out.csv'
+    subprocess.run([sys.executable, APP, '-i', str(data), '-l', '0', '-r', '1', '-t', 'step', '-n', '5', '-o', str(out)], check=True, cwd=tmp_path)
+    assert pd.read_csv(out)['label'].tolist() == ['a'] * 4
+
+
+def test_invalid_input_leaves_no_outputs(tmp_path):
+    run = subprocess.run([sys.executable, APP, '-i', str(tmp_path / 'missing.csv'), '-l', '0', '-r', '1', '-o', str(tmp_path / 'out.csv')], cwd=tmp_path)
+    assert run.returncode != 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_downcast_keeps_ranges_at_64_bits():
+    df = bin_data.downcast_columns(label_data(), NAMES, 0, 1)
+    assert df['pos'].dtype == np.int64
+    assert df['y'].dtype == np.int8
+
+
+def test_memory_limit_is_enforced_before_merging_label(tmp_path):
+    data = tmp_path / 'big.csv'
+    data.write_text(''.join('a,'+str(p)+','+str(p % 5)+'\n' for p in range(1, 60001)))
+    args = [sys.executable, APP, '-i', str(data), '-l', '0', '-r', '1', '-n', '100', '-ch', '5000', '-s', 'false']
+    subprocess.run(args + ['-t', 'step', '-o', str(tmp_path / 'mem.csv')], check=True, cwd=tmp_path)
+    subprocess.run(args + ['-t', 'step', '-mm', '0.1', '-o', str(tmp_path / 'lim.csv')], check=True, cwd=tmp_path)
+    assert (tmp_path / 'lim.csv').read_text() == (tmp_path / 'mem.csv').read_text()
+    run = subprocess.run(args + ['-t', 'bin', '-mm', '0.1', '-o', str(tmp_path / 'bin.csv')], cwd=tmp_path)
+    assert run.returncode != 0
+
+
+def test_checkpoint_records_labels_after_sync(tmp_path):
+    writer = bin_data.OutputWriter(str(tmp_path / 'out'), 5)
+    writer.begin({'settings': {}, 'input': None})
+    df = pd.DataFrame({'label': ['a'], 'position': ['1-5'], 'x': [1.0]})
+    writer.write('a', df)
+    writer.write('b', df.assign(label='b'))
+    assert len(writer.read_checkpoint()) == 1
+    writer.sync()
+    entries = writer.read_checkpoint()
+    assert [entry['label'] for entry in entries[1:]] == ['a', 'b']
+    assert entries[-1]['outputs'] == [os.path.getsize(tmp_path / 'out.csv.part')]
+
+
+def test_checkpoint_is_removed_after_complete_run(tmp_path):
+    data = tmp_path / 'tiny.csv'
+    data.write_text(''.join('a,'+str(p)+','+str(p % 3)+'\n' for p in range(1, 21)))
+    args = [sys.executable, APP, '-i', str(data), '-l', '0', '-r', '1', '-t', 'step', '-n', '5', '-s', 'false']
+    subprocess.run(args + ['-o', str(tmp_path / 'out.csv')], check=True, cwd=tmp_path)
+    assert not os.path.exists(tmp_path / 'out.ckpt')
+    subprocess.run(args + ['-o', str(tmp_path / 'kept.csv'), '-ap', 'true'], check=True, cwd=tmp_path)
+    assert os.path.exists(tmp_path / 'kept.ckpt')
+
+
+def test_sample_matrix_honors_engine_and_chunk_options(tmp_path):
+    for sample, step in (('s1', 1), ('s2', 2)):
+        (tmp_path / (sample+'.csv')).write_text(''.join(lab+','+str(p)+','+str(p % 7)+'\n' for lab in 'ab' for p in range(1, 101, step)))
+    inputs = str(tmp_path / 's1.csv')+','+str(tmp_path / 's2.csv')
+    args = [sys.executable, APP, '-i', inputs, '-l', '0', '-r', '1', '-t', 'value', '-n', '20', '-c', 'ave,std', '-ch', '30']
+    subprocess.run(args + ['-s', 'false', '-o', str(tmp_path / 'memory.csv')], check=True, cwd=tmp_path)
+    subprocess.run(args + ['-e', 'stream', '-o', str(tmp_path / 'stream.csv')], check=True, cwd=tmp_path)
+    assert (tmp_path / 'stream.csv').read_text() == (tmp_path / 'memory.csv').read_text()
+    assert len(pd.read_csv(tmp_path / 'CHUNKS' / 's2' / 'chunk_b.csv')) == 50
+    assert (tmp_path / 'label_in_chunks_s1.txt').read_text().splitlines()[0].startswith('a,100,')
+    bin_data.sample_slices(str(tmp_path / 's1.csv'), 0, 1, '', '', 30, 'ave', 20)
+    assert not bin_data.LABELS
+
+
+def test_prefetch_with_workers_is_reported(tmp_path):
+    data = tmp_path / 'tiny.csv'
+    data.write_text(''.join(lab+','+str(p)+','+str(p % 3)+'\n' for lab in 'ab' for p in range(1, 21)))
+    subprocess.run([sys.executable, APP, '-i', str(data), '-l', '0', '-r', '1', '-o', str(tmp_path / 'out.csv')], check=True, cwd=tmp_path)
+    run = subprocess.run([sys.executable, APP, '-i', str(tmp_path / 'CHUNKS'), '-l', '0', '-r', '1', '-w', '2', '-pf', '2', '-o', str(tmp_path / 'dir.csv')],
+                         check=True, cwd=tmp_path, capture_output=True, text=True)
+    assert '[-pf]' in run.stderr
+    assert (tmp_path / 'dir.csv').read_text() == (tmp_path / 'out.csv').read_text()
+
+
+def test_label_index_output_equals_scan(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv')
+    args = ['-i', data, '-l', 0, '-r', 1, '-t', 'step', '-n', 7, '-c', 'ave,max', '-ch', 20, '-ll', 'c,b']
+    run(tmp_path, *args, '-o', tmp_path / 'scan.csv')
+    run(tmp_path, *args, '-ix', 'true', '-o', tmp_path / 'index.csv')
+    assert os.path.exists(str(data) + '.lidx')
+    run(tmp_path, *args, '-ix', 'true', '-o', tmp_path / 'reused.csv')
+    scan = (tmp_path / 'scan.csv').read_text()
+    assert (tmp_path / 'index.csv').read_text() == scan
+    assert (tmp_path / 'reused.csv').read_text() == scan
+    assert pd.read_csv(tmp_path / 'scan.csv')['label'].unique().tolist() == ['b', 'c']
+
+
+def bgzf(data, size=500):
+    """Compress data into BGZF blocks (gzip members with the BC subfield holding the block size) ending with the empty EOF block"""
+
+    out = b''
+    for block in [data[i:i + size] for i in range(0, len(data), size)] + [b'']:
+        deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = deflate.compress(block) + deflate.flush()
+        out += b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + struct.pack('<H', 6) + b'BC' + struct.pack('<HH', 2, 25 + len(body))
+        out += body + struct.pack('<II', zlib.crc32(block), len(block))
+    return out
+
+
+def test_compressed_inputs_equal_plain_input(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv', rows=300).read_bytes()
+    (tmp_path / 'raw.csv.gz').write_bytes(gzip.compress(data))
+    (tmp_path / 'raw.csv.bgz').write_bytes(bgzf(data))
+    args = ['-l', 0, '-r', 1, '-t', 'value', '-n', 25, '-c', 'ave,std', '-ch', 100]
+    run(tmp_path, '-i', tmp_path / 'raw.csv', *args, '-o', tmp_path / 'plain.csv')
+    run(tmp_path, '-i', tmp_path / 'raw.csv.gz', *args, '-o', tmp_path / 'gzip.csv')
+    run(tmp_path, '-i', tmp_path / 'raw.csv.bgz', *args, '-w', 2, '-o', tmp_path / 'bgzf.csv')
+    plain = (tmp_path / 'plain.csv').read_text()
+    assert (tmp_path / 'gzip.csv').read_text() == plain
+    assert (tmp_path / 'bgzf.csv').read_text() == plain
+
+
+def test_runs_and_bedgraph_inputs_equal_rows(tmp_path):
+    rows, intervals = [], []
+    for lab in 'ab':
+        start = 0
+        for length, depth in [(5, 2), (3, 0), (7, 4), (2, 1), (9, 3), (4, 4), (6, 0)] * 3:
+            rows += [lab+','+str(p)+','+str(depth)+'\n' for p in range(start + 1, start + length + 1)]
+            intervals.append(lab+'\t'+str(start)+'\t'+str(start + length)+'\t'+str(depth)+'\n')
+            start += length
+    (tmp_path / 'rows.csv').write_text(''.join(rows))
+    (tmp_path / 'depth.bedgraph').write_text(''.join(intervals))
+    for split in ('step', 'value'):
+        args = ['-l', 0, '-r', 1, '-t', split, '-n', 10, '-c', 'ave,max,sum']
+        run(tmp_path, '-i', tmp_path / 'rows.csv', *args, '-o', tmp_path / 'rows_out.csv')
+        run(tmp_path, '-i', tmp_path / 'rows.csv', *args, '-if', 'runs', '-o', tmp_path / 'runs_out.csv')
+        run(tmp_path, '-i', tmp_path / 'depth.bedgraph', *args, '-if', 'bedgraph', '-o', tmp_path / 'bedgraph_out.csv')
+        ref = pd.read_csv(tmp_path / 'rows_out.csv')
+        assert pd.read_csv(tmp_path / 'runs_out.csv').equals(ref)
+        assert pd.read_csv(tmp_path / 'bedgraph_out.csv').to_numpy().tolist() == ref.to_numpy().tolist()
+
+
+def test_resume_after_interrupted_run_and_append(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv', labels='abcd')
+    args = ['-i', data, '-l', 0, '-r', 1, '-t', 'step', '-n', 7, '-c', 'ave,std', '-ch', 25]
+    run(tmp_path, *args, '-o', tmp_path / 'full.csv')
+    full = (tmp_path / 'full.csv').read_text()
+    ### the run killed after the first label: the temporary output has more data than recorded, and the last record is cut
+    run(tmp_path, *args, '-rs', 'true', '-o', tmp_path / 'out.csv')
+    os.replace(tmp_path / 'out.csv', tmp_path / 'out.csv.part')
+    lines = (tmp_path / 'out.ckpt').read_text().splitlines(True)
+    (tmp_path / 'out.ckpt').write_text(''.join(lines[:2]) + lines[2][:10])
+    log = run(tmp_path, *args, '-rs', 'true', '-o', tmp_path / 'out.csv', '-v').stderr
+    assert 'after 1 completed labels' in log
+    assert (tmp_path / 'out.csv').read_text() == full
+    ### rows added to the last label and a new label are appended to the output of the complete run
+    text = data.read_text()
+    cut = text.index('d,31,')
+    data.write_text(text[:cut])
+    run(tmp_path, *args, '-ap', 'true', '-o', tmp_path / 'app.csv')
+    data.write_text(text)
+    raw_file(tmp_path / 'more.csv', labels='e')
+    with open(data, 'a') as f:
+        f.write((tmp_path / 'more.csv').read_text())
+    run(tmp_path, *args, '-o', tmp_path / 'full.csv')
+    run(tmp_path, *args, '-ap', 'true', '-o', tmp_path / 'app.csv')
+    assert (tmp_path / 'app.csv').read_text() == (tmp_path / 'full.csv').read_text()
+
+
+def test_shards_merged_equal_unsharded_run(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv', labels='abcdefg')
+    args = ['-i', data, '-l', 0, '-r', 1, '-t', 'step', '-n', 7, '-c', 'ave,count']
+    for i in range(3):
+        run(tmp_path, *args, '-sh', str(i)+'/3', '-o', tmp_path / 'depth')
+    assert sum(len(pd.read_csv(tmp_path / ('depth.shard'+str(i)+'of3.csv'))) > 0 for i in range(3)) > 1
+    subprocess.run([sys.executable, APP, 'merge', '-o', str(tmp_path / 'depth')], check=True, cwd=tmp_path)
+    run(tmp_path, *args, '-o', tmp_path / 'full.csv')
+    assert (tmp_path / 'depth.csv').read_text() == (tmp_path / 'full.csv').read_text()
+
+
+def test_regions_equal_run_on_rows_within_regions(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv')
+    (tmp_path / 'regions.bed').write_text('track name=test\na\t10\t30\nc\t40\t60\textra\n')
+    (tmp_path / 'within.csv').write_text(''.join(line for line in data.read_text().splitlines(True)
+                                                 if (line[0] == 'a' and 10 < int(line.split(',')[1]) <= 30) or (line[0] == 'c' and int(line.split(',')[1]) > 40)))
+    args = ['-l', 0, '-r', 1, '-t', 'step', '-n', 7, '-c', 'ave,max,count']
+    run(tmp_path, '-i', data, *args, '-rg', tmp_path / 'regions.bed', '-o', tmp_path / 'regions.csv')
+    run(tmp_path, '-i', data, *args, '-rg', tmp_path / 'regions.bed', '-e', 'stream', '-ch', 25, '-o', tmp_path / 'stream.csv')
+    run(tmp_path, '-i', tmp_path / 'within.csv', *args, '-o', tmp_path / 'within_out.csv')
+    out = pd.read_csv(tmp_path / 'regions.csv')
+    assert out['label'].unique().tolist() == ['a', 'c']
+    assert out.iloc[0]['position'] == '11-17'
+    assert (tmp_path / 'regions.csv').read_text() == (tmp_path / 'within_out.csv').read_text()
+    assert (tmp_path / 'stream.csv').read_text() == (tmp_path / 'within_out.csv').read_text()
+
+
+def test_windows_equal_pandas_slices_of_rows(tmp_path):
+    data = raw_file(tmp_path / 'raw.csv', labels='ab', rows=24)
+    run(tmp_path, '-i', data, '-l', 0, '-r', 1, '-t', 'window', '-n', 5, '-sd', 2, '-c', 'ave,min,max,std', '-d', 4, '-o', tmp_path / 'out.csv')
+    out = pd.read_csv(tmp_path / 'out.csv')
+    df = pd.read_csv(data, names=['label', 'pos', 'x', 'y'])
+    ref = []
+    for lab, rows in df.groupby('label'):
+        for start in range(0, len(rows) - 3, 2):
+            win = rows.iloc[start:start + 5]
+            ref.append([lab, str(win['pos'].iloc[0])+'-'+str(win['pos'].iloc[-1])] + win[['x', 'y']].agg(['mean', 'min', 'max', 'std']).T.to_numpy().ravel().tolist())
+    assert out[['label', 'position']].to_numpy().tolist() == [row[:2] for row in ref]
+    assert np.allclose(out.iloc[:, 2:].to_numpy(float), [row[2:] for row in ref], atol=1e-4)
+    assert out.iloc[-1]['position'] == '21-24'
@@ -6,36 +6,404 @@ import logging                  # to provide verbosity level
 from pathlib import Path        # to manage paths in the file system
 from datetime import datetime	# to create unique tag into the default output filename
 import csv			# to read any column-like text file
+import os                       # to manage temporary files of sorted runs
+import tempfile                 # to create temporary directory for sorted runs
+import shutil                   # to remove temporary directory with sorted runs
+import heapq                    # to merge sorted runs of inputs
+from itertools import groupby, islice, product   # to stream groups of rows sharing the same key
+from concurrent.futures import ProcessPoolExecutor   # to load and prepare inputs in parallel
+import hashlib                  # to key cached inputs by their content
 import pandas as pd		# to easily parse json object and filter out data; require installation with conda or pip
 
 
 sep=','
+MERGE_FAN_IN = 64                # maximum number of sorted runs opened at once by the external join
 
-def get_delimiter(text_file: str) -> str:
+def get_delimiter(text_file: str, lines: int = 0) -> str:
     with open(text_file, 'r') as csvfile:
-        delimiter = str(csv.Sniffer().sniff(csvfile.read()).delimiter)
+        sample = ''.join(islice(csvfile, lines)) if lines else csvfile.read()      # optionally, only the first lines
+        delimiter = str(csv.Sniffer().sniff(sample).delimiter)
         return delimiter
 
 
-def load_input_file(input_file):
+def load_input_file(input_file, delim=None, **kwargs):
 
     try:
         format = input_file.split('.')[1]
     except:
         format = ''
     if format == 'xlsx':
-        return pd.read_excel(input_file, index_col=None, header=0)  # read xlsx file with pairs of matched labales (.xlsx)
+        return pd.read_excel(input_file, index_col=None, header=0, **kwargs)  # read xlsx file with pairs of matched labales (.xlsx)
     else:
-        delim = get_delimiter(input_file)
-        return pd.read_csv(input_file, sep=delim, index_col=None, header=0)  # read text file separated with any delimiter
+        delim = delim or get_delimiter(input_file)
+        return pd.read_csv(input_file, sep=delim, index_col=None, header=0, **kwargs)  # read text file separated with any delimiter
 
 
-def merge_data(files, matching_cols, keep_cols, error_value, outfile, output_format):
+def input_header(input_file):
+    """Read only the header of the input; returns the column names and the delimiter detected from the first lines (None for xlsx)"""
+
+    delim = None if input_file.endswith('.xlsx') else get_delimiter(input_file, 100)
+    return load_input_file(input_file, delim, nrows=0).columns.tolist(), delim
+
+
+def load_kept_columns(input_file, delim, names, usecols, sample=1000):
+    """Parse only the kept columns of the input with explicit dtypes inferred from the first rows
+       (falls back to the parser inference when later rows do NOT fit the sampled dtypes)"""
+
+    dtypes = load_input_file(input_file, delim, usecols=usecols, nrows=sample).dtypes.to_dict()
+    try:
+        df = load_input_file(input_file, delim, usecols=usecols, dtype=dtypes)
+    except (ValueError, TypeError, OverflowError):
+        df = load_input_file(input_file, delim, usecols=usecols)
+    df.columns = [names[i] for i in usecols]                                    # the parser keeps the file order of columns
+    return df
+
+
+def matching_column(cols, mcol, num):
+    """Find the header of the matching column given by its index or name (None if it does NOT exist)"""
+
+    if mcol.isnumeric():
+        return cols[int(mcol)]
+    elif str(mcol)+"_"+str(num) in cols:
+        return str(mcol)+"_"+str(num)
+    return None
+
+
+def kept_columns(cols, lab, keep, num, f):
+    """Resolve indexes, names, and a-b ranges of columns to be kept from the input into their headers (the matching column goes first)"""
+
+    KEEP = [lab]
+    for n, col in enumerate(keep):
+        if col.isnumeric() and int(col) < len(cols):
+            KEEP.append(cols[int(col)])
+        elif str(col)+"_"+str(num) in cols:
+            KEEP.append(str(col)+"_"+str(num))
+        elif col == '':
+            for i in cols:
+                KEEP.append(i)
+        else:
+            col = col.split('-')
+            if len(col) == 2 and col[0].isnumeric() and col[1].isnumeric():
+                for each in range(int(col[0]), int(col[1]) + 1):
+                    if each < len(cols):
+                        KEEP.append(cols[each])
+            else:
+                logging.warning('The provided columns: ' + str(col) + ' expected to be kept from the ' +
+                                str(f) + ' file are incorrect and can NOT be merged into output. Please check your files.')
+    return list(dict.fromkeys(KEEP))
+
+
+def cache_key(input_file, content_hash=False):
+    """Key of the parsed input in the cache: absolute path, size and modification time of the input (and optionally the hash of its content)"""
+
+    stat = os.stat(input_file)
+    key = hashlib.sha1((os.path.abspath(input_file) + '|' + str(stat.st_size) + '|' + str(stat.st_mtime_ns)).encode())
+    if content_hash:
+        with open(input_file, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                key.update(block)
+    return key.hexdigest()
+
+
+def cached_input(input_file, cache_dir, content_hash=False):
+    """Return the cached parsed input (parquet, or pickle when columns can NOT be saved in parquet);
+       on a miss, parse the whole input and save it in the cache, on a hit mark the entry as recently used"""
+
+    key = cache_key(input_file, content_hash)
+    for ext in ('.parquet', '.pkl'):
+        path = os.path.join(cache_dir, key + ext)
+        if os.path.isfile(path):
+            os.utime(path)                                                      # the modification time orders entries for LRU eviction
+            logging.info('   The parsed ' + str(input_file) + ' loaded from the cache: ' + path)
+            return path
+    df = load_input_file(input_file)
+    df.columns = [str(name) for name in df.columns]
+    tmp = os.path.join(cache_dir, key + '.' + str(os.getpid()) + '.tmp')
+    try:
+        df.to_parquet(tmp, index=False)
+        path = os.path.join(cache_dir, key + '.parquet')
+    except Exception:                                                           # missing pyarrow or mixed types in columns
+        df.to_pickle(tmp)
+        path = os.path.join(cache_dir, key + '.pkl')
+    os.replace(tmp, path)                                                       # atomic, so parallel workers never see partial entries
+    logging.info('   The parsed ' + str(input_file) + ' saved in the cache: ' + path)
+    return path
+
+
+def cached_columns(path):
+    """Read only the header of the cached input"""
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return pd.read_pickle(path).columns.tolist()
+
+
+def load_cached(path, names, usecols=None):
+    """Load the cached input, optionally only the columns at usecols positions"""
+
+    columns = [names[i] for i in usecols] if usecols is not None else None
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    df = pd.read_pickle(path)
+    return df[columns] if columns is not None else df
+
+
+def evict_cache(cache_dir, cache_size):
+    """Remove the least recently used entries of the cache until its size fits the cap (in MB)"""
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(('.parquet', '.pkl'))]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    total = 0
+    for path in entries:
+        total += os.path.getsize(path)
+        if total > cache_size * 1000000:
+            os.remove(path)
+            logging.info('   The least recently used ' + path + ' removed from the cache.')
+
+
+def init_worker(level):
+    """Set the verbosity of the worker process (logging is NOT inherited by processes started with spawn)"""
+
+    logging.getLogger().setLevel(level)
+
+
+def prepare_input(num, f, mcol, keep, cache=None):
+    """Load the input, make its headers unique with the _num suffix, find the matching column and keep only selected columns;
+       returns the prepared dataframe and the name of its matching column (None, None if the matching column does NOT exist)"""
+
+    try:
+        if cache:                                                                       # parsed input from the cache (cache_dir, content_hash)
+            path = cached_input(f, *cache)
+            names = cached_columns(path)
+        else:
+            names, delim = input_header(f)						# header-only read
+        cols = [str(name)+"_"+str(num) for name in names]				# headers in files
+    except:
+        logging.error('The ' + str(f) + ' was not loaded. ')
+        sys.exit(1)
+
+    #-- if provided indexes of matching_cols, then find their headers
+    lab = matching_column(cols, mcol, num)						# names of matching columns
+    if lab is None:
+        logging.warning('The user-provided index or name of matching column (' + str(mcol) +
+                        ') does NOT exist in the corresponding input file: ' + str(f) + ': \n' +
+                        str(pd.Index(cols)) + '. The columns from the ' + str(f) + ' file will NOT be merged in the output..')
+        return None, None
+
+    #-- if provided columns to be kept, then parse only these columns
+    try:
+        if len(keep):
+            KEEP = kept_columns(cols, lab, keep, num, f)
+            usecols = sorted(cols.index(col) for col in KEEP)
+            if cache:
+                df = load_cached(path, names, usecols)
+                df.columns = [cols[i] for i in usecols]
+            else:
+                df = load_kept_columns(f, delim, cols, usecols)			# file1, file2, ...
+        elif cache:
+            df = load_cached(path, names)
+            df.columns = cols
+        else:
+            df = load_input_file(f, delim)
+            df.columns = cols								# make sure headers among inputs are unique (different columns names for inputs with the same format)
+    except:
+        logging.error('The ' + str(f) + ' was not loaded. ')
+        sys.exit(1)
+
+    #-- order kept columns as requested
+    if len(keep):
+        try:
+            df = df[KEEP]
+            if lab in KEEP:
+                KEEP.remove(lab)
+            logging.info('- ' + str(f) + ' : ' + str(KEEP))
+        except:
+            logging.error('Selecting columns: \n' + str(KEEP) + '\n expected to be kept from ' + str(f) + ' file has failed.')
+    return df, lab
+
+
+def key_of(value):
+    """Sort key of the external join: numbers (in numeric order) go before texts (in lexicographic order)"""
+
+    try:
+        x = float(value)
+        if x == x:
+            return (0, x, '')
+    except ValueError:
+        pass
+    return (1, 0.0, value)
+
+
+def sorted_runs(f, num, mcol, keep, buffer, tmpdir, presorted=False, limit=MERGE_FAN_IN):
+    """Read the text input in blocks of buffer rows and save each block sorted by the matching column as an on-disk run of kept columns,
+       merging runs into longer ones until at most limit runs are left;
+       returns the kept headers, the position of the matching column among them, and the streams of (key, row) pairs of all runs"""
+
+    sep = get_delimiter(f, 100)
+    with open(f, newline='') as fh:
+        reader = csv.reader(fh, delimiter=sep)
+        cols = [str(name)+"_"+str(num) for name in next(reader)]
+        lab = matching_column(cols, mcol, num)
+        if lab is None:
+            logging.error('The user-provided index or name of matching column (' + str(mcol) +
+                          ') does NOT exist in the corresponding input file: ' + str(f) + ': \n' + str(cols))
+            sys.exit(1)
+        KEEP = kept_columns(cols, lab, keep, num, f) if len(keep) else cols
+        idx = [cols.index(col) for col in KEEP]
+        k = KEEP.index(lab)
+        if presorted:                                   # the input is streamed directly
+            return KEEP, k, [input_rows(f, sep, idx, k)]
+        runs = []
+        while True:
+            block = [[row[i] if i < len(row) else '' for i in idx] for row in islice(reader, buffer)]
+            if not block:
+                break
+            block.sort(key=lambda row: key_of(row[k]))
+            runs.append(os.path.join(tmpdir, 'run_' + str(num) + '_' + str(len(runs)) + '.csv'))
+            with open(runs[-1], 'w', newline='') as out:
+                csv.writer(out).writerows(block)
+    logging.info('- ' + str(f) + ' : ' + str(len(runs)) + ' sorted runs of kept columns ' + str(KEEP))
+    runs = merge_runs(runs, k, tmpdir, num, limit)
+    return KEEP, k, [run_rows(run, k) for run in runs]
+
+
+def merge_runs(runs, k, tmpdir, num, limit, fan_in=MERGE_FAN_IN):
+    """Merge consecutive sorted runs in passes, at most fan_in runs at once, until at most limit runs are left,
+       so the number of files opened at once stays bounded; the order of rows with the same key is kept"""
+
+    level = 0
+    while len(runs) > limit:
+        merged = []
+        for a in range(0, len(runs), fan_in):
+            group = runs[a:a + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.append(os.path.join(tmpdir, 'run_' + str(num) + '_' + str(len(merged)) + '_pass' + str(level) + '.csv'))
+            with open(merged[-1], 'w', newline='') as out:
+                csv.writer(out).writerows(row for key, row in heapq.merge(*[run_rows(run, k) for run in group], key=lambda x: x[0]))
+            for run in group:
+                os.remove(run)
+        logging.info('  merged ' + str(len(runs)) + ' runs into ' + str(len(merged)) + ' runs')
+        runs = merged
+        level += 1
+    return runs
+
+
+def run_rows(run, k):
+    """Stream (key, row) pairs of the sorted run"""
+
+    with open(run, newline='') as fh:
+        for row in csv.reader(fh):
+            yield key_of(row[k]), row
+
+
+def input_rows(f, sep, idx, k):
+    """Stream (key, row) pairs of kept columns of the input sorted by the matching column, checking the order on the way"""
+
+    prev, last = None, ''
+    with open(f, newline='') as fh:
+        reader = csv.reader(fh, delimiter=sep)
+        next(reader)
+        for row in reader:
+            row = [row[i] if i < len(row) else '' for i in idx]
+            key = key_of(row[k])
+            if prev is not None and key < prev:
+                logging.error('The input ' + str(f) + ' is NOT sorted by the matching column: ' + str(row[k]) + ' after ' + str(last))
+                sys.exit(1)
+            prev, last = key, row[k]
+            yield key, row
+
+
+def merge_external(files, matching_cols, keep_cols, error_value, outfile, presorted=False, buffer=1000000):
+    """Join inputs larger than memory: sort each input by its matching column into on-disk runs (or stream inputs sorted already),
+       and stream the k-way sort-merge outer join of all inputs into the CSV output; memory is bounded by the buffer of rows"""
+
+    tmpdir = tempfile.mkdtemp(prefix='MERGE_', dir=os.path.dirname(os.path.abspath(outfile)))
+    limit = max(MERGE_FAN_IN // len(files), 1)             # runs per input left for the final merge of all inputs
+    started = False
+    try:
+        KEEPS, POS, GROUPS = [], [], []
+        for num, f in enumerate(files):
+            if not Path(f).is_file():
+                logging.error('The ' + str(f) + 'does NOT exist. Please provide the correct list of inputs.')
+                sys.exit(1)
+            if f.endswith('.xlsx'):
+                logging.error('The external join requires column-like text inputs; the ' + str(f) + ' file is NOT supported.')
+                sys.exit(1)
+            KEEP, k, streams = sorted_runs(f, num, matching_cols[num], keep_cols[num] if len(keep_cols) else [], buffer, tmpdir, presorted, limit)
+            KEEPS.append(KEEP)
+            POS.append(k)
+            GROUPS.append(groupby(heapq.merge(*streams, key=lambda x: x[0]), key=lambda x: x[0]))    # rows of each input grouped by keys
+
+        logging.info('4. Streaming the sort-merge join of ' + str(len(files)) + ' inputs...')
+        error = str(error_value)
+        heads = [next(groups, None) for groups in GROUPS]
+        started = True
+        with open(outfile + '.csv', 'w', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow([''] + KEEPS[0] + [col for num, KEEP in enumerate(KEEPS[1:], 1) for n, col in enumerate(KEEP) if n != POS[num]])
+            n = 0
+            while any(head is not None for head in heads):
+                key = min(head[0] for head in heads if head is not None)
+                parts = []
+                text = None                                     # key as written in the first input containing it
+                for num, head in enumerate(heads):
+                    if head is not None and head[0] == key:
+                        rows = [row for k, row in head[1]]
+                        heads[num] = next(GROUPS[num], None)
+                        text = rows[0][POS[num]] if text is None else text
+                    else:
+                        rows = [None]
+                    parts.append(rows)
+                for rows in product(*parts):                    # all combinations of rows with duplicated keys
+                    line = [n]
+                    for num, row in enumerate(rows):
+                        if row is None:
+                            row = [text if num == 0 and i == POS[0] else error for i in range(len(KEEPS[num]))]
+                        line += [value if value != '' else error for i, value in enumerate(row) if num == 0 or i != POS[num]]
+                    writer.writerow(line)
+                    n += 1
+    except BaseException:                                       # e.g., an unsorted input found in the sorted mode
+        if started and os.path.exists(outfile + '.csv'):
+            os.remove(outfile + '.csv')                         # no partial output is left
+        raise
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    logging.info('5. The merged data of ' + str(n) + ' rows is saved to ' + outfile + '.csv file.\n\n')
+
+
+def join_inputs(FILES, LABS, error_value):
+    """Join all inputs at once by their matching columns (outer join on the union of keys sorted as in pd.merge) and fill missing values once"""
+
+    nums = list(FILES.keys())
+    first = nums[0]
+    pos = FILES[first].columns.get_loc(LABS[first])                     # position of the matching column in the first input
+    indexed = [FILES[num].set_index(LABS[num]) for num in nums]
+    if all(df.index.is_unique for df in indexed):
+        DF = pd.concat(indexed, axis=1, join='outer')                   # single aligned concat of all inputs
+        try:
+            DF = DF.sort_index()
+        except TypeError:
+            logging.warning('The values of matching columns have different types and can NOT be sorted.')
+    else:                                                               # keep all combinations of rows with duplicated keys
+        logging.warning('The matching columns contain duplicated values, so inputs are joined one by one.')
+        DF = indexed[0]
+        for df in indexed[1:]:
+            DF = DF.join(df, how='outer')
+    DF = pd.concat([pd.DataFrame({LABS[first]: DF.index}), DF.reset_index(drop=True)], axis=1)
+    cols = DF.columns.tolist()
+    cols.insert(pos, cols.pop(0))
+    return DF[cols].fillna(error_value)
+
+
+def merge_data(files, matching_cols, keep_cols, error_value, outfile, output_format, external='false', buffer=1000000, workers=1,
+               cache_dir='', cache_size=1000, cache_hash='false'):
 
     tag = datetime.now().strftime("-%d-%m-%Y-%H%M%S")
 
     FILES = {}
-    COLS = {}
     LABS = {}
     DF = pd.DataFrame()
     
@@ -88,70 +456,44 @@ def merge_data(files, matching_cols, keep_cols, error_value, outfile, output_for
         logging.info('3. The following columns from each file will be kept:')
     else:
         logging.info('3. All columns from every file will be kept.')
-        
-    #-- check if all inputs exist; if true, load their content
-#    sep = get_delimiter(files[0])
-    for num, f in enumerate(files):
+
+    #-- join inputs larger than memory with the on-disk sort-merge
+    if external != 'false':
+        if output_format == 2:
+            logging.error('The external join streams the output in CSV format; the xlsx output is NOT supported.')
+            sys.exit(1)
+        if outfile == 'data_output':
+            outfile += tag
+        merge_external(files, matching_cols, keep_cols, error_value, outfile, external == 'sorted', buffer)
+        for num, i in enumerate(files):
+            print(num, i)
+        return
+
+    #-- check if all inputs exist; if true, load and prepare their content (in parallel with workers)
+    for f in files:
         if not Path(f).is_file():
             logging.error('The ' + str(f) + 'does NOT exist. Please provide the correct list of inputs.')
             sys.exit(1)
-        else:
-            try:
-                FILES[num] = load_input_file(f)							# file1, file2, ...
-                COLS[num] = [str(name)+"_"+str(num) for name in FILES[num].columns.tolist()]		# headers in files
-                FILES[num].columns = COLS[num]							# make sure headers among inputs are unique (different columns names for inputs with the same format)
-            except:
-                logging.error('The ' + str(f) + ' was not loaded. ')
-                sys.exit(1)
-
-            #-- if provided indexes of matching_cols, then find their headers
-            if matching_cols[num].isnumeric():
-                LABS[num] = COLS[num][int(matching_cols[num])]					# names of matching columns
-            elif str(matching_cols[num])+"_"+str(num) in COLS[num]:
-                LABS[num] = str(matching_cols[num])+"_"+str(num)
-            else:
-                COLS.pop(num, None)
-                FILES.pop(num, None)
-                logging.warning('The user-provided index or name of matching column (' + str(matching_cols[num]) +
-                              ') does NOT exist in the corresponding input file: ' + str(f) + ': \n' +
-                              str(FILES[num].columns) + '. The columns from the ' + str(f) + ' file will NOT be merged in the output..')
-
-            #-- if provided columns to be kept, then filter dataframes
-            if len(keep_cols):
-                tmp_cols = keep_cols[num]
-                KEEP = [LABS[num]]
-                for n, col in enumerate(tmp_cols):
-                    if col.isnumeric() and int(col) < len(COLS[num]):
-                        KEEP.append(COLS[num][int(col)])
-                    elif str(col)+"_"+str(num) in COLS[num]:
-                        KEEP.append(str(col)+"_"+str(num))
-                    elif col == '':
-                        for i in COLS[num]:
-                            KEEP.append(i)
-                    else:
-                        col = col.split('-')
-                        if len(col) == 2 and col[0].isnumeric() and col[1].isnumeric():
-                            for each in range(int(col[0]), int(col[1]) + 1):
-                                if each < len(COLS[num]):
-                                    KEEP.append(COLS[num][each])
-                        else:
-                            logging.warning('The provided columns: ' + str(col) + ' expected to be kept from the ' +
-                                            str(f) + ' file are incorrect and can NOT be merged into output. Please check your files.')
-                try:
-                    KEEP = list(dict.fromkeys(KEEP))
-                    FILES[num] = FILES[num][KEEP]
-                    if LABS[num] in KEEP:
-                        KEEP.remove(LABS[num])
-                    logging.info('- ' + str(f) + ' : ' + str(KEEP))
-                except:
-                    logging.error('Selecting columns: \n' + str(KEEP) + '\n expected to be kept from ' + str(f) + ' file has failed.')
-                        
-###-- add all columns from file2 into file1 based on matching columns
-        if num == 0:
-            DF = FILES[num]
-        else:
-            DF = pd.merge(DF, FILES[num], left_on=[LABS[0]], right_on=LABS[num], how='outer').drop(LABS[num], axis=1).fillna(error_value)
+    keeps = keep_cols if len(keep_cols) else [[] for f in files]
+    cache = None
+    if cache_dir != '':
+        os.makedirs(cache_dir, exist_ok=True)
+        cache = (cache_dir, cache_hash == 'true')
+    if workers > 1 and len(files) > 1:
+        logging.info('   Loading ' + str(len(files)) + ' inputs with ' + str(workers) + ' workers...')
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(logging.getLogger().level,)) as pool:
+            loaded = list(pool.map(prepare_input, range(len(files)), files, matching_cols, keeps, [cache for f in files]))   # results in the order of inputs
+    else:
+        loaded = [prepare_input(num, f, matching_cols[num], keeps[num], cache) for num, f in enumerate(files)]
+    if cache:
+        evict_cache(cache_dir, cache_size)
+    for num, (df, lab) in enumerate(loaded):
+        if df is not None:
+            FILES[num] = df
+            LABS[num] = lab
 
+###-- add all columns from next files into the first file based on matching columns
+    DF = join_inputs(FILES, LABS, error_value)
     logging.info('4. The merged dataframe was successfully created!')
 
 ###-- export output data_file
@@ -223,6 +565,56 @@ if __name__ == '__main__':
         default=0,
         dest='format'
     )
+    parser.add_argument(
+        '-x', '--external',
+        help='[string] join inputs larger than memory with the on-disk sort-merge: false, true (sort inputs into on-disk runs), sorted (inputs are sorted by matching columns already); output in csv format',
+        metavar='external',
+        type=str,
+        choices=['false', 'true', 'sorted'],
+        default='false',
+        dest='external'
+    )
+    parser.add_argument(
+        '-b', '--buffer',
+        help='[int] number of rows of each input sorted in memory at once in the external join',
+        metavar='buffer',
+        type=int,
+        default=1000000,
+        dest='buffer'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        help='[int] number of parallel workers loading and preparing inputs',
+        metavar='workers',
+        type=int,
+        default=1,
+        dest='workers'
+    )
+    parser.add_argument(
+        '-d', '--cache-dir',
+        help='[string] directory of the on-disk cache of parsed inputs reused by repeated runs; empty string disables the cache',
+        metavar='cache',
+        type=str,
+        default='',
+        dest='cache'
+    )
+    parser.add_argument(
+        '-ds', '--cache-size',
+        help='[int] size cap of the cache in MB; the least recently used inputs are removed above it',
+        metavar='size',
+        type=int,
+        default=1000,
+        dest='cache_size'
+    )
+    parser.add_argument(
+        '-dh', '--cache-hash',
+        help='[string] key cached inputs also by the hash of their content (not only by path, size and modification time): true, false',
+        metavar='hash',
+        type=str,
+        choices=['true', 'false'],
+        default='false',
+        dest='cache_hash'
+    )
     parser.add_argument(
          '-v', '--verbose', 
          const=1, 
@@ -235,7 +627,7 @@ if __name__ == '__main__':
 ###-- print example of usage and help message when script is run without required arguments
     if len(sys.argv) < 3:
         parser.print_help()
-        print("\nUSAGE:\n	e.g., python3 merge_data.py -i input_file1,input_file2 -c 0 \n")
+        print("\nUSAGE:\n	e.g., python3 merge_data.py -i input_file1,input_file2 -c 0 \n	e.g., python3 merge_data.py -i input_file1,input_file2 -c 0 -x true -b 1000000	(inputs larger than memory)\n")
         sys.exit(1)
 
     args = parser.parse_args()
@@ -245,4 +637,5 @@ if __name__ == '__main__':
     elif args.verbose >= 1:
         logger.setLevel(logging.INFO)
 
-    merge_data(args.files, args.mcols, args.kcols, args.error, args.outfile, args.format)
+    merge_data(args.files, args.mcols, args.kcols, args.error, args.outfile, args.format, args.external, args.buffer, args.workers,
+               args.cache, args.cache_size, args.cache_hash)
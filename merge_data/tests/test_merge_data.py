@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import merge_data
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'merge_data.py')
+
+
+def run(cwd, *args):
+    """Run merge_data.py with the options in the working directory"""
+
+    return subprocess.run([sys.executable, APP] + [str(arg) for arg in args], check=True, cwd=cwd, capture_output=True, text=True)
+
+
+def inputs(path, n=3, rows=12):
+    """Write n inputs with partly overlapping ids (in different orders) and a value column each; returns the comma-separated list"""
+
+    files = []
+    for num in range(n):
+        ids = list(range(num * 3, num * 3 + rows))[::(-1) ** num]
+        files.append(path / ('in'+str(num)+'.csv'))
+        files[-1].write_text('id,name,val\n' + ''.join(str(i)+',g'+str(i % 4)+','+str(round(i * 0.5 + num, 1))+'\n' for i in ids))
+    return ','.join(str(f) for f in files)
+
+
+def test_single_join_equals_chained_outer_merges():
+    FILES = {num: pd.DataFrame({'val_'+str(num): [num + 0.5] * 4, 'id_'+str(num): [num + i * 2 for i in range(4)]}) for num in range(3)}
+    LABS = {num: 'id_'+str(num) for num in range(3)}
+    out = merge_data.join_inputs(FILES, LABS, -1)
+    ref = FILES[0]
+    for num in (1, 2):
+        ref = ref.merge(FILES[num], left_on='id_0', right_on='id_'+str(num), how='outer')
+        ref['id_0'] = ref['id_0'].fillna(ref.pop('id_'+str(num)))
+    ref = ref.sort_values('id_0').reset_index(drop=True).fillna(-1)
+    assert out.columns.tolist() == ['val_0', 'id_0', 'val_1', 'val_2']
+    assert out['id_0'].tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8]
+    assert out.to_numpy().tolist() == ref[out.columns].to_numpy().tolist()
+
+
+def test_duplicated_keys_keep_all_combinations():
+    FILES = {0: pd.DataFrame({'id_0': [1, 1, 2], 'a_0': [10, 11, 20]}), 1: pd.DataFrame({'id_1': [1, 1, 3], 'b_1': [5, 6, 30]})}
+    out = merge_data.join_inputs(FILES, {0: 'id_0', 1: 'id_1'}, -1)
+    assert sorted(out.to_numpy().tolist()) == [[1, 10, 5], [1, 10, 6], [1, 11, 5], [1, 11, 6], [2, 20, -1], [3, -1, 30]]
+
+
+def test_merged_output_has_union_of_ids(tmp_path):
+    run(tmp_path, '-i', inputs(tmp_path), '-c', 0, '-f', 1, '-o', tmp_path / 'out')
+    out = pd.read_csv(tmp_path / 'out.csv', index_col=0)
+    assert out.columns.tolist() == ['id_0', 'name_0', 'val_0', 'name_1', 'val_1', 'name_2', 'val_2']
+    assert out['id_0'].tolist() == list(range(18))
+    assert out.loc[out['id_0'] == 4, ['val_0', 'val_1', 'val_2']].to_numpy().tolist() == [[2.0, 3.0, -9999.99]]
+
+
+def test_external_join_equals_in_memory_join(tmp_path):
+    files = inputs(tmp_path, n=4)
+    run(tmp_path, '-i', files, '-c', 0, '-f', 1, '-o', tmp_path / 'memory')
+    run(tmp_path, '-i', files, '-c', 0, '-x', 'true', '-b', 5, '-o', tmp_path / 'external')
+    assert pd.read_csv(tmp_path / 'external.csv', index_col=0).equals(pd.read_csv(tmp_path / 'memory.csv', index_col=0))
+    assert [name for name in os.listdir(tmp_path) if name.startswith('MERGE_')] == []
+    ### the runs of an input merged into a single one keep the sorted order
+    (tmp_path / 'runs').mkdir()
+    KEEP, k, streams = merge_data.sorted_runs(files.split(',')[1], 1, '0', [], 2, str(tmp_path / 'runs'), limit=1)
+    assert len(streams) == 1
+    assert [row[k] for key, row in streams[0]] == [str(i) for i in range(3, 15)]
+
+
+def test_sorted_join_rejects_unsorted_input(tmp_path):
+    files = inputs(tmp_path).split(',')
+    run(tmp_path, '-i', files[0]+','+files[2], '-c', 0, '-x', 'sorted', '-o', tmp_path / 'sorted')
+    run(tmp_path, '-i', files[0]+','+files[2], '-c', 0, '-f', 1, '-o', tmp_path / 'memory')
+    assert pd.read_csv(tmp_path / 'sorted.csv', index_col=0).equals(pd.read_csv(tmp_path / 'memory.csv', index_col=0))
+    fail = subprocess.run([sys.executable, APP, '-i', files[0]+','+files[1], '-c', '0', '-x', 'sorted', '-o', str(tmp_path / 'out')], cwd=tmp_path, capture_output=True, text=True)
+    assert fail.returncode != 0
+    assert 'is NOT sorted' in fail.stderr
+    assert not os.path.exists(tmp_path / 'out.csv')
+
+
+def test_parallel_loading_equals_sequential(tmp_path):
+    files = inputs(tmp_path, n=4)
+    run(tmp_path, '-i', files, '-c', 'id', '-k', 'val', '-f', 1, '-o', tmp_path / 'one')
+    log = run(tmp_path, '-i', files, '-c', 'id', '-k', 'val', '-f', 1, '-w', 2, '-o', tmp_path / 'two', '-v').stderr
+    assert 'with 2 workers' in log
+    assert "in3.csv : ['val_3']" in log
+    assert (tmp_path / 'two.csv').read_text() == (tmp_path / 'one.csv').read_text()
+
+
+def test_kept_columns_equal_selection_of_full_input(tmp_path):
+    f = str(tmp_path / 'in0.csv')
+    inputs(tmp_path, n=1)
+    df, lab = merge_data.prepare_input(0, f, 'id', ['2', 'name'])
+    full = pd.read_csv(f)
+    full.columns = [name+'_0' for name in full.columns]
+    assert lab == 'id_0'
+    assert df.columns.tolist() == ['id_0', 'val_0', 'name_0']
+    assert df.equals(full[df.columns])
+    assert merge_data.prepare_input(0, f, '0', ['1-2'])[0].columns.tolist() == ['id_0', 'name_0', 'val_0']
+    ### later rows that do NOT fit the dtypes sampled from the first rows
+    with open(f, 'a') as fh:
+        fh.write('99,g3,low\n')
+    df = merge_data.load_kept_columns(f, ',', ['id', 'name', 'val'], [0, 2], sample=5)
+    assert df.columns.tolist() == ['id', 'val']
+    assert df['val'].iloc[-1] == 'low'
+
+
+def test_cached_inputs_equal_parsed_inputs(tmp_path):
+    files = inputs(tmp_path, n=2)
+    args = ['-i', files, '-c', 0, '-f', 1, '-d', tmp_path / 'cache', '-v']
+    run(tmp_path, '-i', files, '-c', 0, '-f', 1, '-o', tmp_path / 'plain')
+    assert 'saved in the cache' in run(tmp_path, *args, '-o', tmp_path / 'miss').stderr
+    log = run(tmp_path, *args, '-k', '2', '-o', tmp_path / 'hit').stderr
+    assert log.count('loaded from the cache') == 2
+    assert (tmp_path / 'miss.csv').read_text() == (tmp_path / 'plain.csv').read_text()
+    assert pd.read_csv(tmp_path / 'hit.csv', index_col=0).equals(pd.read_csv(tmp_path / 'plain.csv', index_col=0)[['id_0', 'val_0', 'val_1']])
+    ### a changed input is parsed again
+    f = files.split(',')[1]
+    with open(f, 'a') as fh:
+        fh.write('40,g0,1.5\n')
+    log = run(tmp_path, *args, '-o', tmp_path / 'changed').stderr
+    assert log.count('loaded from the cache') == 1
+    assert pd.read_csv(tmp_path / 'changed.csv')['id_0'].iloc[-1] == 40
+    ### the content hash tells apart inputs with the same size and modification time
+    stat = os.stat(f)
+    keys = merge_data.cache_key(f), merge_data.cache_key(f, True)
+    with open(f, 'r+') as fh:
+        fh.write('id,name,VAL')
+    os.utime(f, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert merge_data.cache_key(f) == keys[0]
+    assert merge_data.cache_key(f, True) != keys[1]
+    ### the least recently used entries are removed above the size cap
+    merge_data.evict_cache(str(tmp_path / 'cache'), 0)
+    assert os.listdir(tmp_path / 'cache') == []